@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mrkt.common import patch
+
+patch()
+
+
+def noop(x=None):
+    return x
+
+
+def spin(seconds):
+    end = time() + seconds
+    while time() < end:
+        pass
+
+
+def echo_len(data):
+    return len(data)
+
+
+def make_bytes(size):
+    return bytes(size)
+
+
+def percentiles(values, qs=(50, 90, 99)):
+    values = sorted(values)
+    return {"p{}".format(q): values[min(len(values) - 1, len(values) * q // 100)] for q in qs}
+
+
+def make_pool(agents, port, **options):
+    from mrkt.framework import Pool, Hosts, LocalProcess
+    return Pool([Hosts(LocalProcess())], containers_per_host=agents, worker_port=port, **options)
+
+
+def bench_throughput(pool, tasks):
+    results = {}
+    for chunksize in (1, 100, "auto"):
+        start = time()
+        count = sum(1 for _ in pool.map(noop, range(tasks), chunksize=chunksize))
+        results["chunksize_{}".format(chunksize)] = dict(tasks=count, tasks_per_second=count / (time() - start))
+    return results
+
+
+def bench_latency(pool, rounds):
+    from mrkt.framework.cluster.stats import intervals
+    totals, stages = [], {}
+    for _ in range(rounds):
+        task = pool.submit(noop)
+        task.join()
+        durations = intervals(task.stages)
+        totals.append(durations["total"])
+        for stage, seconds in durations.items():
+            stages.setdefault(stage, []).append(seconds)
+    return dict(rounds=rounds, total=percentiles(totals),
+                stages={stage: percentiles(values) for stage, values in stages.items()})
+
+
+def round_trip(pool, size, func, *args):
+    task = pool.submit(func, *args)
+    task.join()
+    elapsed = task.stages["deserialized"] - task.stages["connected"]
+    return dict(seconds=elapsed, mb_per_second=size / elapsed / 1e6)
+
+
+def bench_bandwidth(pool, sizes):
+    results = {}
+    for size in sizes:
+        data = bytes(size)
+        results[str(size)] = dict(argument=round_trip(pool, size, echo_len, data),
+                                  result=round_trip(pool, size, make_bytes, size))
+    return results
+
+
+def make_tree(path, files, file_size):
+    for i in range(files):
+        directory = os.path.join(path, "d{}".format(i // 100))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "f{}".format(i)), "wb") as f:
+            f.write(os.urandom(file_size))
+
+
+def bench_sync(pool, trees):
+    from mrkt.common import sync
+    worker = next(pool.workers)
+    results, cwd = {}, os.getcwd()
+    root = tempfile.mkdtemp(prefix="mrkt_bench_")
+    try:
+        os.chdir(root)
+        for files, file_size in trees:
+            path = "tree_{}x{}".format(files, file_size)
+            make_tree(path, files, file_size)
+            timings, manifest = {}, {}
+            for run in ("initial", "unchanged", "touched"):
+                if run == "touched":
+                    make_tree(path, max(1, files // 100), file_size)
+                start = time()
+                manifest = sync.scan(path, manifest)
+                worker.sync_with_manifest(manifest, path)
+                timings[run] = time() - start
+            results[path] = dict(files=files, bytes=files * file_size, seconds=timings)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def bench_scaling(agent_counts, port, tasks, seconds):
+    results = {}
+    for agents in agent_counts:
+        with make_pool(agents, port) as pool:
+            list(pool.map(noop, range(agents)))
+            start = time()
+            list(pool.map(spin, [seconds] * tasks))
+            elapsed = time() - start
+            results[str(agents)] = dict(agents=agents, capacity=pool.capacity, seconds=elapsed,
+                                        tasks_per_second=tasks / elapsed)
+    return results
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, "{}{}.".format(prefix, key))
+        elif isinstance(value, (int, float)):
+            yield prefix + key, value
+
+
+def compare(results, baseline_file, threshold):
+    with open(baseline_file) as f:
+        baseline = dict(flatten(json.load(f)["results"]))
+    for key, value in flatten(results):
+        if baseline.get(key):
+            change = value / baseline[key] - 1
+            if abs(change) >= threshold:
+                print("{:<70} {:>12.4g} -> {:<12.4g} {:+.1%}".format(key, baseline[key], value, change))
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mrkt overhead benchmarks on loopback agents")
+    parser.add_argument("-o", "--output", type=str, help="result file (default: results/<timestamp>.json)")
+    parser.add_argument("-p", "--port", type=int, default=18333, help="first agent port")
+    parser.add_argument("-a", "--agents", type=int, default=2, help="agents for the single-pool benchmarks")
+    parser.add_argument("--only", nargs="*", help="benchmarks to run",
+                        choices=["throughput", "latency", "bandwidth", "sync", "scaling"])
+    parser.add_argument("--tasks", type=int, default=2000, help="tasks for the throughput benchmark")
+    parser.add_argument("--rounds", type=int, default=200, help="rounds for the latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1 << 20, 16 << 20, 64 << 20],
+                        help="payload sizes for the bandwidth benchmark")
+    parser.add_argument("--scaling", type=int, nargs="*", default=[1, 2, 4], help="agent counts to scale over")
+    parser.add_argument("--baseline", type=str, help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported by --baseline")
+    args = parser.parse_args()
+    selected = set(args.only or ["throughput", "latency", "bandwidth", "sync", "scaling"])
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = os.path.abspath(args.output or os.path.join(here, "results", "{}.json".format(int(time()))))
+    os.chdir(here)
+
+    results = {}
+    if selected & {"throughput", "latency", "bandwidth", "sync"}:
+        with make_pool(args.agents, args.port) as pool:
+            list(pool.map(noop, range(args.agents)))
+            if "throughput" in selected:
+                results["throughput"] = bench_throughput(pool, args.tasks)
+            if "latency" in selected:
+                results["latency"] = bench_latency(pool, args.rounds)
+            if "bandwidth" in selected:
+                results["bandwidth"] = bench_bandwidth(pool, args.sizes)
+            if "sync" in selected:
+                results["sync"] = bench_sync(pool, [(100, 10 << 10), (1000, 10 << 10), (20, 1 << 20)])
+            results["stats"] = pool.stats()
+    if "scaling" in selected:
+        results["scaling"] = bench_scaling(args.scaling, args.port, 64, 0.05)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(dict(meta=dict(time=time(), revision=revision(), python=platform.python_version(),
+                                 machine=platform.machine(), cpus=len(os.sched_getaffinity(0)), args=vars(args)),
+                       results=results), f, indent=1)
+    print(json.dumps({key: value for key, value in results.items() if key != "stats"}, indent=1))
+    print("results written to {}".format(output))
+    if args.baseline:
+        compare(results, args.baseline, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,28 +2,45 @@ from gevent.monkey import patch_thread;
 
 patch_thread()
 import gevent
+import gevent.socket
+from gevent.lock import Semaphore
 import argparse
 import importlib
 import os
 import os.path
 import logging
 import signal
+import socket
 import sys
 from multiprocessing import Process
+from time import time
 from uuid import uuid1
 
-from ..common.port import ObjPort
-from ..common.exceptions import TaskFailure
-from ..common.consts import AGENT_PORT, AGENT_CLEAN_INTERVAL
-from ..common.utils import dir_sig, dir_patch, function_index
+from .pool import ProcessPool
+from ..common.port import ObjPort, Channel, CODECS, loads
+from ..common.store import ObjectStore, ObjectRef
+from ..common.exceptions import TaskFailure, ObjectUnreachable
+from ..common.consts import AGENT_PORT, AGENT_CLEAN_INTERVAL, AGENT_MAX_TASKS_PER_CHILD, AGENT_FETCH_CONNECT_RETRIES
+from ..common import sync
+from ..common.utils import function_index
 
 
 class Agent:
-    def __init__(self):
+    def __init__(self, prefork=None, max_tasks_per_child=AGENT_MAX_TASKS_PER_CHILD, idle_timeout=None):
         self.port = None
+        self.listener = None
+        self.agent_id = uuid1().int
         self.function_store = {}
         self.register_adm_functions()
         self.processes = {}
+        self.store = ObjectStore()
+        self.prefork = prefork
+        self.max_tasks_per_child = max_tasks_per_child
+        self.task_pool = None
+        self.idle_timeout = idle_timeout
+        self.connections = 0
+        self.last_active = time()
+        self.expired = False
 
     def register(self, func, index=None):
         index = index or function_index(func)
@@ -44,6 +61,8 @@ class Agent:
 
     @staticmethod
     def _adm_cpu_count():
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
         return os.cpu_count()
 
     def _adm_suspend(self, uuid):
@@ -58,61 +77,176 @@ class Agent:
             os.kill(p.pid, signal.SIGCONT)
         return True
 
+    def _adm_kill(self, uuid):
+        p = self.processes.get(uuid, None)
+        if p:
+            os.kill(p.pid, signal.SIGKILL)
+        return True
+
     def _adm_list(self):
         return list(self.function_store.keys())
 
-    def invoke(self, port, func, kwargs):
-        self.port = port
-        for name, arg in kwargs.items():
-            var_cls = func.__annotations__.get(name, None)
-            if hasattr(var_cls, "__load__"):
-                kwargs[name] = var_cls.__load__(arg)
+    def _adm_store_put(self, key, frame, refs=1):
+        self.store.put(key, loads(frame), frame.size, refs)
+        return True
+
+    def _adm_store_release(self, key):
+        self.store.release(key)
+        return True
+
+    def _adm_store_get(self, key):
+        return self.store.get(key)
+
+    def fetch_objects(self, calls):
+        for source, keys in self.store.missing(calls).items():
+            keys = list(keys)
+            try:
+                channel = Channel(source, retries=AGENT_FETCH_CONNECT_RETRIES)
+                try:
+                    objs, _, (size, _) = channel.request(uuid1().int, "_adm_store_get",
+                                                         [dict(key=key) for key in keys])
+                finally:
+                    channel.close()
+            except OSError as e:
+                raise ObjectUnreachable(keys) from e
+            # the address the client advertised may point somewhere else from here, e.g. at this agent
+            if any(isinstance(obj, TaskFailure) for obj in objs):
+                raise ObjectUnreachable(keys)
+            for key, obj in zip(keys, objs):
+                self.store.put(key, obj, size // len(keys), 0)
+
+    def keep_results(self, reply, keep):
+        rid, rets, span = loads(reply)
+        for i, (key, ret) in enumerate(zip(keep, rets)):
+            if not isinstance(ret, TaskFailure):
+                size = reply.size // len(rets)
+                self.store.put(key, ret, size)
+                rets[i] = ObjectRef(key, size=size)
+        return ObjPort.dump((rid, rets, span))
+
+    def invoke(self, func, kwargs):
         try:
+            self.store.resolve(kwargs)
+            for name, arg in kwargs.items():
+                var_cls = func.__annotations__.get(name, None)
+                if hasattr(var_cls, "__load__"):
+                    kwargs[name] = var_cls.__load__(arg)
             res = func(**kwargs)
         except Exception as e:
             res = TaskFailure(e)
         if hasattr(res, "__dump__"):
             res = res.__dump__()
-        port.write(res)
+        return res
+
+    def invoke_all(self, func, calls):
+        return [self.invoke(func, kwargs) for kwargs in calls]
+
+    def timed_invoke_all(self, func, calls):
+        start = time()
+        rets = self.invoke_all(func, calls)
+        return rets, (start, time())
+
+    def run_task(self, sock, rid, func, calls):
+        ObjPort(sock).write((rid, *self.timed_invoke_all(func, calls)))
 
     def run(self, port=0, pipe=None):
         logging.info("[%s] stated on %s", self.__class__.__name__, port)
-        listener = ObjPort.create_listener(port, pipe)
+        self.listener = ObjPort.create_listener(port, pipe)
+        if self.prefork is not None:
+            self.task_pool = ProcessPool(self, self.prefork or self._adm_cpu_count(), self.max_tasks_per_child)
         gevent.spawn(self.pool_cleaner)
         while True:
-            port = listener.accept()
-            gevent.spawn(self.request_handler, port)
+            try:
+                port = self.listener.accept()
+            except OSError:
+                if self.expired:
+                    logging.info("[%s] idle for %ss, exiting", self.__class__.__name__, self.idle_timeout)
+                    if self.task_pool:
+                        # pooled children only notice a changed parent pid, and multiprocessing joins them at exit
+                        self.task_pool.stop()
+                    return
+                raise
+            gevent.spawn(self.connection_handler, port)
+
+    def is_idle(self):
+        return self.idle_timeout is not None and not self.connections and not self.processes and \
+               time() - self.last_active > self.idle_timeout
 
     def pool_cleaner(self):
         while True:
             self.processes = {uuid: p for uuid, p in self.processes.items() if p.is_alive()}
+            if self.task_pool:
+                self.task_pool.reap()
             logging.debug("[%s.Cleaner]: remaining %s tasks", self.__class__.__name__, len(self.processes))
+            if self.is_idle():
+                self.expired = True
+                self.listener.close()
+                return
             gevent.sleep(AGENT_CLEAN_INTERVAL)
 
-    def request_handler(self, port):
-        logging.info("[%s.request_handler] begins on %s", self.__class__.__name__, port)
-        uuid = uuid1().int
-        port.write(uuid)
-        message = port.read()
-        index, kwargs = message
-        func = self.look_up_function(index)
+    def connection_handler(self, port):
+        logging.info("[%s.connection_handler] begins on %s", self.__class__.__name__, port)
+        self.connections += 1
+        try:
+            port.write((self.agent_id, list(CODECS)))
+            port.set_compression(*port.read())
+            while True:
+                rid, index, calls, keep = port.read()
+                self.last_active = time()
+                gevent.spawn(self.request_handler, port, rid, index, calls, keep)
+        except OSError:
+            logging.info("[%s.connection_handler] ends on %s", self.__class__.__name__, port)
+            port.close()
+        finally:
+            self.connections -= 1
+            self.last_active = time()
+
+    def request_handler(self, port, rid, index, calls, keep=None):
         logging.info("[%s.request_handler]: executes %s", self.__class__.__name__, index)
-        if not index.startswith("_adm_"):
-            p = Process(target=self.invoke, name="mrtk_t{}".format(uuid), args=(port, func, kwargs))
-            setattr(p, "task", (index, func, kwargs))
-            p.start()
-            self.processes[uuid] = p
+        try:
+            func = self.look_up_function(index)
+            self.fetch_objects(calls)
+        except Exception as e:
+            reply = ObjPort.dump((rid, [TaskFailure(e)] * len(calls), None))
         else:
-            self.invoke(port, func, kwargs)
+            if index.startswith("_adm_"):
+                self.port = port
+                reply = ObjPort.dump((rid, *self.timed_invoke_all(func, calls)))
+            elif self.task_pool:
+                reply = self.task_pool.execute(rid, index, calls)
+            else:
+                reply = self.fork_task(rid, index, func, calls)
+            if keep:
+                reply = self.keep_results(reply, keep)
+        try:
+            port.write_frame(reply)
+        except OSError:
+            logging.warning("[%s.request_handler]: lost reply of %s", self.__class__.__name__, index)
+
+    def fork_task(self, rid, index, func, calls):
+        reader, writer = socket.socketpair()
+        p = Process(target=self.run_task, name="mrtk_t{}".format(rid), args=(writer, rid, func, calls))
+        setattr(p, "task", (index, func, calls))
+        p.start()
+        writer.close()
+        self.processes[rid] = p
+        try:
+            return ObjPort(gevent.socket.socket(fileno=reader.detach())).read_frame()
+        except OSError as e:
+            return ObjPort.dump((rid, [TaskFailure(e)] * len(calls), None))
 
 
 class DynamicAgent(Agent):
-    def __init__(self, path=None):
-        super(DynamicAgent, self).__init__()
+    def __init__(self, path=None, **options):
+        super(DynamicAgent, self).__init__(**options)
         self.module_cache = {}
+        self.manifest_store = None
+        self.manifest_lock = Semaphore()
+        self.synced_layers = []
         if path:
             self.path = os.path.abspath(path)
             sys.path.insert(1, os.path.abspath(path))
+            self.manifest_store = sync.ManifestStore(self.path)
 
     def look_up_function(self, index):
         if index not in self.function_store:
@@ -124,17 +258,56 @@ class DynamicAgent(Agent):
             self.register(func, index)
         return self.function_store[index]
 
-    def _adm_dir_signature(self, subpath, is_dir=True):
-        return dir_sig(os.path.join(self.path, subpath), is_dir)
+    def _adm_synced_layers(self):
+        return self.synced_layers
+
+    def mark_synced(self, layer, fingerprint):
+        self.synced_layers = self.synced_layers[:layer] + [fingerprint]
 
-    def _adm_dir_patch(self, delta, subpath):
-        return dir_patch(os.path.join(self.path, subpath), delta)
+    def on_manifest_store(self, method, *args):
+        # chunking and hashing release the GIL, so keep them off the loop that serves tasks and heartbeats
+        with self.manifest_lock:
+            return gevent.get_hub().threadpool.apply(getattr(self.manifest_store, method), args)
+
+    def _adm_dir_manifest(self, subpath, ignore=(), fingerprint=None):
+        manifest = self.on_manifest_store("manifest", subpath, ignore)
+        # an up-to-date copy is answered with None instead of the whole tree
+        return None if fingerprint is not None and sync.fingerprint(manifest) == fingerprint else manifest
+
+    def _adm_dir_read_chunks(self, subpath, digests):
+        return self.on_manifest_store("read_chunks", subpath, digests)
+
+    def _adm_dir_pull(self, sync_id, subpath, manifest, peer, ignore=(), layer=None, fingerprint=None):
+        changed, deleted, missing = sync.diff(manifest, self.on_manifest_store("manifest", subpath, ignore))
+        logging.info("[%s.dir_pull]: %s chunks from %s", self.__class__.__name__, len(missing), peer)
+        channel = Channel(tuple(peer))
+        try:
+            for digests in sync.batches(missing):
+                (chunks,), _, _ = channel.request(uuid1().int, "_adm_dir_read_chunks",
+                                                  [dict(subpath=subpath, digests=digests)])
+                if isinstance(chunks, TaskFailure):
+                    chunks.re_raise()
+                self.manifest_store.put_chunks(sync_id, chunks)
+        finally:
+            channel.close()
+        return self._adm_dir_apply(sync_id, subpath, changed, deleted, ignore, layer, fingerprint)
+
+    def _adm_dir_put_chunks(self, sync_id, chunks):
+        return self.manifest_store.put_chunks(sync_id, chunks)
+
+    def _adm_dir_apply(self, sync_id, subpath, changed, deleted, ignore=(), layer=None, fingerprint=None):
+        self.on_manifest_store("apply", sync_id, subpath, changed, deleted, ignore)
+        if layer is not None:
+            self.mark_synced(layer, fingerprint)
+        return True
 
     def _adm_clean_cache(self):
         for module_name, module in list(self.module_cache.items()):
             self.module_cache[module_name] = importlib.reload(module)
         self.function_store = {}
         self.register_adm_functions()
+        if self.task_pool:
+            self.task_pool.recycle()
         return True
 
     @classmethod
@@ -146,6 +319,16 @@ class DynamicAgent(Agent):
                             help="port", default=AGENT_PORT)
         parser.add_argument("-l", "--logging", type=str,
                             help="Logging level", default="warning")
+        parser.add_argument("--prefork", type=int, nargs="?", const=0,
+                            help="run tasks in a pool of persistent processes (default size: cpu count)")
+        parser.add_argument("--max-tasks-per-child", type=int,
+                            help="recycle pooled processes after this many tasks",
+                            default=AGENT_MAX_TASKS_PER_CHILD)
+        parser.add_argument("--idle-timeout", type=float,
+                            help="exit after this many seconds without connections")
         args = parser.parse_args()
         logging.basicConfig(level=getattr(logging, args.logging.upper()))
-        cls(args.path).run(port=args.port)
+        cls(args.path,
+            prefork=args.prefork,
+            max_tasks_per_child=args.max_tasks_per_child,
+            idle_timeout=args.idle_timeout).run(port=args.port)
@@ -0,0 +1,137 @@
+import gevent
+import gevent.socket
+import gevent.queue
+import logging
+import os
+import select
+import socket
+from multiprocessing import Process
+
+from ..common.port import ObjPort
+from ..common.store import ObjectStore
+from ..common.exceptions import TaskFailure
+from ..common.consts import AGENT_CLEAN_INTERVAL
+
+
+class TaskProcess:
+    def __init__(self, agent, generation):
+        self.generation = generation
+        self.served = 0
+        self.objects = set(agent.store.keys())
+        parent_sock, child_sock = socket.socketpair()
+        self.process = Process(target=self.serve, name="mrtk_w", args=(agent, child_sock, os.getpid()))
+        self.process.start()
+        child_sock.close()
+        self.port = ObjPort(gevent.socket.socket(fileno=parent_sock.detach()))
+
+    @staticmethod
+    def serve(agent, sock, parent_pid):
+        port = ObjPort(sock)
+        while True:
+            if not select.select([sock], [], [], AGENT_CLEAN_INTERVAL)[0]:
+                if os.getppid() != parent_pid:
+                    break
+                continue
+            try:
+                rid, index, calls, objects, dropped = port.read()
+            except OSError:
+                break
+            agent.store.update(objects)
+            agent.store.drop(dropped)
+            try:
+                rets, span = agent.timed_invoke_all(agent.look_up_function(index), calls)
+            except Exception as e:
+                rets, span = [TaskFailure(e)] * len(calls), None
+            port.write((rid, rets, span))
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def execute(self, rid, index, calls, store):
+        self.served += 1
+        refs = ObjectStore.refs(calls)
+        objects = {key: store.get(key) for key in refs - self.objects if key in store}
+        dropped = [key for key in self.objects if key not in store]
+        self.objects.update(objects)
+        self.objects.difference_update(dropped)
+        self.port.write((rid, index, calls, objects, dropped))
+        return self.port.read_frame()
+
+    def stop(self, join=False):
+        self.port.close()
+        if self.process.is_alive():
+            self.process.kill()
+        if join:
+            self.process.join()
+
+
+class ProcessPool:
+    def __init__(self, agent, size, max_tasks_per_child=None):
+        self.agent = agent
+        self.size = size
+        self.max_tasks_per_child = max_tasks_per_child
+        self.generation = 0
+        self.idle = gevent.queue.Queue()
+        self.retired = []
+        for _ in range(size):
+            self.idle.put(self.spawn())
+
+    def spawn(self):
+        return TaskProcess(self.agent, self.generation)
+
+    def recycle(self):
+        self.generation += 1
+
+    def retire(self, proc):
+        proc.stop()
+        self.retired.append(proc)
+
+    def reap(self):
+        self.retired = [p for p in self.retired if p.is_alive()]
+
+    def stop(self):
+        procs = self.retired + [p for p in self.agent.processes.values() if isinstance(p, TaskProcess)]
+        while not self.idle.empty():
+            procs.append(self.idle.get())
+        for proc in procs:
+            proc.stop(join=True)
+        self.retired = []
+
+    def checkout(self):
+        proc = self.idle.get()
+        if proc.generation != self.generation or not proc.is_alive():
+            self.retire(proc)
+            proc = self.spawn()
+        return proc
+
+    def checkin(self, proc):
+        if self.max_tasks_per_child and proc.served >= self.max_tasks_per_child:
+            logging.debug("[%s.checkin]: recycles %s after %s tasks",
+                          self.__class__.__name__, proc.pid, proc.served)
+            self.retire(proc)
+            proc = self.spawn()
+        self.idle.put(proc)
+
+    def execute(self, rid, index, calls):
+        proc = self.checkout()
+        self.agent.processes[rid] = proc
+        try:
+            reply = proc.execute(rid, index, calls, self.agent.store)
+        except OSError as e:
+            logging.warning("[%s.execute]: process %s exited with %s",
+                            self.__class__.__name__, proc.pid, proc.process.exitcode)
+            self.retire(proc)
+            proc = self.spawn()
+            reply = ObjPort.dump((rid, [TaskFailure(e)] * len(calls), None))
+        except BaseException:
+            self.retire(proc)
+            self.idle.put(self.spawn())
+            raise
+        finally:
+            self.agent.processes.pop(rid, None)
+        self.checkin(proc)
+        return reply
@@ -1,15 +1,54 @@
+import os.path
+
 AGENT_PORT = 8333
 AGENT_CLEAN_INTERVAL = 5
+AGENT_MAX_TASKS_PER_CHILD = 1000
+AGENT_STORE_CAPACITY = 2 << 30
+AGENT_FETCH_CONNECT_RETRIES = 1
+
+SCHEDULER_PORT = 8334
+SCHEDULER_CLIENT_MAX_PENDING = 256
 
 CLUSTER_SYNC_CURRENT_DIR = True
-CLUSTER_SCHEDULE_INTERVAL = 0.1
+CLUSTER_SYNC_FANOUT = None
+# hosts holding the image serve `docker save` unauthenticated with ncat on SERVICE_IMAGE_SEED_PORT and up, bound to
+# their first `hostname -I` address: keep those ports closed to the outside, e.g. in the VPC security group
+CLUSTER_IMAGE_FANOUT = None
+
+POOL_CHUNK_TARGET_TIME = 0.2
+POOL_CHUNK_MAX_SIZE = 10000
+POOL_CHUNK_SMOOTHING = 0.3
+POOL_PENDING_FACTOR = 2
+POOL_CACHE_MEMORY_ITEMS = 10000
+POOL_CACHE_DIR = os.path.expanduser("~/.cache/mrkt/results")
+POOL_CACHE_DISK_LIMIT = 1 << 30
+POOL_CACHE_DISK_LOW_WATER = 0.8
+POOL_TASK_RETRIES = 2
+POOL_SPECULATION = None
+POOL_SPECULATION_INTERVAL = 0.5
+POOL_SPECULATION_MIN_SAMPLES = 5
+POOL_SPECULATION_WINDOW = 100
+POOL_PROBE_INTERVAL = 1
+POOL_PROBE_MAX_INTERVAL = 60
+POOL_LOCALITY_WAIT = 0.5
+POOL_LOCALITY_WINDOW = 64
+POOL_STATS_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+POOL_STATS_BYTES_BUCKETS = tuple(1 << i for i in range(6, 31, 2))
 
 PLATFORM_PAAS_VM_WAIT_INTERVAL = 1
 PLATFORM_PAAS_SSH_RETRIES = 10
 PLATFORM_PAAS_SSH_RETRY_INTERVAL = 1
 
+PLATFORM_AUTOSCALE_INTERVAL = 10
+PLATFORM_AUTOSCALE_TARGET_SECONDS = 300
+PLATFORM_AUTOSCALE_IDLE_TIMEOUT = 300
+PLATFORM_AUTOSCALE_MAX_VMS = 10
+PLATFORM_AUTOSCALE_SMOOTHING = 0.3
+
 PLATFORM_EC2_REGION = "ap-southeast-1"
 PLATFORM_EC2_VM_TAG = "mrkt"
+PLATFORM_EC2_AMI_CACHE = os.path.expanduser("~/.cache/mrkt/ami.json")
+PLATFORM_EC2_AMI_TTL = 24 * 3600
 
 SERVICE_CONTAINER_PREFIX = "mrkt"
 
@@ -18,17 +57,37 @@ SERVICE_IMAGE_UPDATE = False
 SERVICE_IMAGE_CLEAN = False
 
 SERVICE_DOCKER_IMAGE = "tefx/mrkt"
+SERVICE_AGENT_PREFORK = None
+SERVICE_CONTAINERS_PER_HOST = 1
+SERVICE_CPU_PINNING = "cpu"
+SERVICE_IMAGE_SEED_PORT = 8332
+SERVICE_KEEP_WARM = False
+SERVICE_AGENT_IDLE_TIMEOUT = 900
+SERVICE_IMAGE_STREAM_BLOCK = 1 << 20
 
 SERVICE_SSH_RETRY_TIMES = 2
 SERVICE_SSH_RETRY_INTERVAL = 1
 
-TASK_WAIT_PID_RETRIES = 5
-TASK_WAIT_PID_RETRY_INTERVAL = 0.5
+WORKER_CHANNEL_NUM = 4
+WORKER_RECONNECT_RETRIES = 1
 
 TOOL_CMD_PIP = "pip"
 
-RDIFF_SIG_FILENAME = ".sig"
-RDIFF_DELTA_FILENAME = ".delta"
+SYNC_STATE_DIR = ".mrkt"
+SYNC_IGNORE_FILENAME = ".mrktignore"
+SYNC_DEFAULT_IGNORE = (".git/", ".hg/", ".svn/", "__pycache__/", "*.pyc", ".venv/", "venv/", ".ipynb_checkpoints/")
+SYNC_INDEX_DIR = os.path.expanduser("~/.cache/mrkt/index")
+SYNC_CHUNK_MIN_SIZE = 2 * 1024
+SYNC_CHUNK_AVG_BITS = 13
+SYNC_CHUNK_MAX_SIZE = 64 * 1024
+SYNC_READ_SIZE = 1 << 20
+SYNC_BATCH_SIZE = 4 << 20
 
 PORT_CONNECT_RETRIES = 10
 PORT_CONNECT_RETRY_INTERVAL = 1
+PORT_HANDSHAKE_RETRIES = 5
+PORT_HANDSHAKE_RETRY_INTERVAL = 0.5
+PORT_RECV_BUFFER_SIZE = 64 * 1024
+PORT_SEND_MAX_PARTS = 512
+PORT_COMPRESSION = "lz4"
+PORT_COMPRESSION_THRESHOLD = 64 * 1024
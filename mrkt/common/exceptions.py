@@ -5,6 +5,16 @@ class TaskError(Exception):
     pass
 
 
+class DependencyError(TaskError):
+    pass
+
+
+class ObjectUnreachable(TaskError):
+    @property
+    def keys(self):
+        return self.args[0]
+
+
 class TaskFailure:
     def __init__(self, exception):
         self.exception = exception
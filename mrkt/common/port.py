@@ -1,12 +1,85 @@
+import io
+import pickle
 import struct
+import types
+import zlib
+from time import time
 import gevent.socket
 import gevent
-from dill import loads, dumps
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+import dill
+import lz4.frame
 
-from .consts import PORT_CONNECT_RETRIES, PORT_CONNECT_RETRY_INTERVAL
+from .consts import *
 
-HEADER_STRUCT = ">L"
+HEADER_STRUCT = ">BI"
 HEADER_LEN = struct.calcsize(HEADER_STRUCT)
+PART_STRUCT = ">BQ"
+PART_LEN = struct.calcsize(PART_STRUCT)
+
+SERIALIZER_PICKLE = 0
+SERIALIZER_DILL = 1
+
+CODEC_IDS = [None, "lz4", "zlib", "zstd"]
+CODECS = {
+    "lz4":  (lz4.frame.compress, lambda buf: lz4.frame.decompress(buf, return_bytearray=True)),
+    "zlib": (zlib.compress, lambda buf: bytearray(zlib.decompress(buf))),
+}
+try:
+    import zstandard
+
+    CODECS["zstd"] = (lambda buf: zstandard.ZstdCompressor().compress(buf),
+                      lambda buf: bytearray(zstandard.ZstdDecompressor().decompress(buf)))
+except ImportError:
+    pass
+
+
+def negotiate_codec(preferred, supported):
+    if preferred in CODECS and preferred in supported:
+        return preferred
+    return None
+
+
+class Frame:
+    __slots__ = ("serializer", "parts", "wire_size")
+
+    def __init__(self, serializer, parts, wire_size=None):
+        self.serializer = serializer
+        self.parts = parts
+        self.wire_size = wire_size
+
+    @property
+    def size(self):
+        return sum(memoryview(part).nbytes for part in self.parts)
+
+
+class Pickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, (type, types.FunctionType)) and obj.__module__ == "__main__":
+            raise pickle.PicklingError("{} must be pickled by value".format(obj))
+        return NotImplemented
+
+
+def dumps(obj):
+    buffers = []
+    try:
+        f = io.BytesIO()
+        Pickler(f, protocol=5, buffer_callback=buffers.append).dump(obj)
+        payload = f.getbuffer()
+        serializer = SERIALIZER_PICKLE
+    except (pickle.PicklingError, TypeError, AttributeError):
+        buffers = []
+        payload = dill.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        serializer = SERIALIZER_DILL
+    return Frame(serializer, [payload] + [b.raw() for b in buffers])
+
+
+def loads(frame):
+    payload, buffers = frame.parts[0], frame.parts[1:]
+    if frame.serializer == SERIALIZER_DILL:
+        return dill.loads(payload, buffers=buffers)
+    return pickle.loads(payload, buffers=buffers)
 
 
 class Remotable:
@@ -27,20 +100,28 @@ class Remotable:
             "{}={}".format(s, getattr(self, s)) for s in self.state))
 
 
-def safe_recv(sock, length):
+def safe_recv_into(sock, view):
     try:
-        buf = sock.recv(length)
-        if not buf:
+        length = sock.recv_into(view)
+        if not length:
             raise OSError("port failed to receive data")
-        return buf
+        return length
     except OSError as e:
         sock.close()
         raise OSError("port failed to receive data") from e
 
 
-def safe_send(sock, buf):
+def safe_send(sock, bufs):
+    views = [memoryview(buf).cast("B") for buf in bufs if len(buf)]
     try:
-        sock.sendall(buf)
+        while views:
+            sent = sock.sendmsg(views[:PORT_SEND_MAX_PARTS])
+            while sent:
+                if sent >= len(views[0]):
+                    sent -= len(views.pop(0))
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
         return True
     except OSError as e:
         sock.close()
@@ -62,27 +143,76 @@ class ObjPort:
     def __init__(self, sock):
         self._sock = sock
         self.address = None
+        self.write_lock = Semaphore()
+        self.codec = None
+        self.compression_threshold = PORT_COMPRESSION_THRESHOLD
+        self.reset_buffer()
 
     def __del__(self):
         self._sock.close()
 
+    def reset_buffer(self):
+        self._rbuf = memoryview(bytearray(PORT_RECV_BUFFER_SIZE))
+        self._rstart = self._rend = 0
+
+    def recv_into(self, view):
+        while len(view):
+            if self._rstart == self._rend:
+                if len(view) >= len(self._rbuf):
+                    view = view[safe_recv_into(self._sock, view):]
+                    continue
+                self._rstart, self._rend = 0, safe_recv_into(self._sock, self._rbuf)
+            length = min(len(view), self._rend - self._rstart)
+            view[:length] = self._rbuf[self._rstart:self._rstart + length]
+            self._rstart += length
+            view = view[length:]
+
+    def recv(self, length):
+        buf = bytearray(length)
+        self.recv_into(memoryview(buf))
+        return buf
+
+    def set_compression(self, codec, threshold=PORT_COMPRESSION_THRESHOLD):
+        self.codec = codec
+        self.compression_threshold = threshold
+
+    def compress(self, part):
+        if self.codec and memoryview(part).nbytes >= self.compression_threshold:
+            compressed = CODECS[self.codec][0](part)
+            if len(compressed) < memoryview(part).nbytes:
+                return CODEC_IDS.index(self.codec), compressed
+        return 0, part
+
+    def read_frame(self):
+        header = self.recv(HEADER_LEN)
+        serializer, num = struct.unpack(HEADER_STRUCT, header)
+        table = self.recv(PART_LEN * num)
+        parts = []
+        wire_size = HEADER_LEN + len(table)
+        for codec, length in struct.iter_unpack(PART_STRUCT, table):
+            part = self.recv(length)
+            wire_size += length
+            parts.append(CODECS[CODEC_IDS[codec]][1](part) if codec else part)
+        return Frame(serializer, parts, wire_size)
+
     def read(self):
-        header = safe_recv(self._sock, HEADER_LEN)
-        length = struct.unpack(HEADER_STRUCT, header)[0]
-        chunks = []
-        while length:
-            recv = safe_recv(self._sock, length)
-            chunks.append(recv)
-            length -= len(recv)
-        buf = b"".join(chunks)
-        return loads(buf)
-
-    def write(self, buf):
-        buf = dumps(buf)
-        if not isinstance(buf, bytes):
-            buf = buf.encode("utf-8")
-        msg = struct.pack(HEADER_STRUCT, len(buf)) + buf
-        return safe_send(self._sock, msg)
+        return loads(self.read_frame())
+
+    @staticmethod
+    def dump(obj):
+        return dumps(obj)
+
+    def write_frame(self, frame):
+        parts = [self.compress(part) for part in frame.parts]
+        header = struct.pack(HEADER_STRUCT, frame.serializer, len(parts))
+        table = b"".join(struct.pack(PART_STRUCT, codec, memoryview(part).nbytes) for codec, part in parts)
+        frame.wire_size = len(header) + len(table) + sum(memoryview(part).nbytes for _, part in parts)
+        with self.write_lock:
+            safe_send(self._sock, [header, table] + [part for _, part in parts])
+        return frame
+
+    def write(self, obj):
+        return self.write_frame(self.dump(obj))
 
     def close(self):
         try:
@@ -98,6 +228,7 @@ class ObjPort:
     @classmethod
     def create_listener(cls, port=0, pipe=None):
         listen_sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_STREAM)
+        listen_sock.setsockopt(gevent.socket.SOL_SOCKET, gevent.socket.SO_REUSEADDR, 1)
         listen_sock.bind(("", port))
         listen_sock.listen(10000)
         if pipe:
@@ -109,9 +240,9 @@ class ObjPort:
         return self.__class__(sock)
 
     @classmethod
-    def create_connector(cls, addr):
+    def create_connector(cls, addr, retries=PORT_CONNECT_RETRIES):
         sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_STREAM)
-        if try_connect(sock, addr, PORT_CONNECT_RETRIES, PORT_CONNECT_RETRY_INTERVAL):
+        if try_connect(sock, addr, retries, PORT_CONNECT_RETRY_INTERVAL):
             port = cls(sock)
             port.address = sock.getpeername()
         else:
@@ -121,3 +252,69 @@ class ObjPort:
     def reconnect(self):
         self._sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_STREAM)
         self._sock.connect(self.address)
+        self.reset_buffer()
+
+
+class Channel:
+    def __init__(self, addr, compression=PORT_COMPRESSION, compression_threshold=PORT_COMPRESSION_THRESHOLD,
+                 retries=PORT_CONNECT_RETRIES):
+        self.port = ObjPort.create_connector(addr, retries)
+        self.agent_id, codecs = self.wait_for_server()
+        codec = negotiate_codec(compression, codecs)
+        self.port.write((codec, compression_threshold))
+        self.port.set_compression(codec, compression_threshold)
+        self.pending = {}
+        self.reader = gevent.spawn(self.dispatch_replies)
+
+    def wait_for_server(self, times=PORT_HANDSHAKE_RETRIES, interval=PORT_HANDSHAKE_RETRY_INTERVAL):
+        try:
+            return self.port.read()
+        except OSError as e:
+            if times:
+                gevent.sleep(interval)
+                self.port.reconnect()
+                return self.wait_for_server(times - 1, interval)
+            else:
+                raise e
+
+    def is_alive(self):
+        return not self.reader.dead
+
+    def load(self):
+        return len(self.pending)
+
+    def request(self, rid, index, calls, stages=None, keep=None):
+        if not self.is_alive():
+            raise OSError("channel to {} is closed".format(self.port.address))
+        stages = {} if stages is None else stages
+        result = AsyncResult()
+        self.pending[rid] = result
+        try:
+            sent = dumps((rid, index, calls, keep))
+            stages["serialized"] = time()
+            self.port.write_frame(sent)
+            stages["sent"] = time()
+            msg, span, received, stages["received"], stages["deserialized"] = result.get()
+            if span:
+                stages["remote_start"], stages["remote_end"] = span
+            return msg, (sent.size, sent.wire_size), (received.size, received.wire_size)
+        finally:
+            self.pending.pop(rid, None)
+
+    def dispatch_replies(self):
+        try:
+            while True:
+                frame = self.port.read_frame()
+                received = time()
+                rid, msg, span = loads(frame)
+                if rid in self.pending:
+                    self.pending[rid].set((msg, span, frame, received, time()))
+        except Exception as e:
+            for result in self.pending.values():
+                result.set_exception(e)
+        finally:
+            self.port.close()
+
+    def close(self):
+        self.reader.kill()
+        self.port.close()
@@ -0,0 +1,117 @@
+import hashlib
+import pickle
+from collections import OrderedDict
+from logging import getLogger
+
+from .port import Frame, dumps
+from .consts import AGENT_STORE_CAPACITY
+
+logger = getLogger(__name__)
+
+
+class ObjectRef:
+    __slots__ = ("key", "source", "size")
+
+    def __init__(self, key, source=None, size=0):
+        self.key = key
+        self.source = source
+        self.size = size
+
+    def __getstate__(self):
+        return self.key, self.source, self.size
+
+    def __setstate__(self, state):
+        self.key, self.source, self.size = state
+
+    def __repr__(self):
+        return "ObjectRef<{}>".format(self.key[:12])
+
+
+class SharedObject:
+    def __init__(self, obj):
+        frame = dumps(obj)
+        digest = hashlib.sha256()
+        for part in frame.parts:
+            digest.update(part)
+        self.key = digest.hexdigest()
+        self.size = frame.size
+        self.frame = Frame(frame.serializer, [pickle.PickleBuffer(part) for part in frame.parts])
+
+    @classmethod
+    def from_frame(cls, key, frame):
+        shared = cls.__new__(cls)
+        shared.key = key
+        shared.size = frame.size
+        shared.frame = frame
+        return shared
+
+    def __dump__(self):
+        return ObjectRef(self.key, size=self.size)
+
+    def __repr__(self):
+        return "SharedObject<{}, {} bytes>".format(self.key[:12], self.size)
+
+
+class ObjectStore:
+    def __init__(self, capacity=AGENT_STORE_CAPACITY):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.usage = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def keys(self):
+        return self.entries.keys()
+
+    def get(self, key):
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, obj, size, refs=1):
+        if key in self.entries:
+            self.entries[key][2] += refs
+        else:
+            self.entries[key] = [obj, size, refs]
+            self.usage += size
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def update(self, objects):
+        for key, obj in objects.items():
+            self.put(key, obj, 0, 0)
+
+    def release(self, key):
+        if key in self.entries:
+            self.entries[key][2] = max(0, self.entries[key][2] - 1)
+        self.evict()
+
+    def drop(self, keys):
+        for key in keys:
+            if key in self.entries:
+                self.usage -= self.entries.pop(key)[1]
+
+    def evict(self):
+        for key in [key for key, (_, _, refs) in self.entries.items() if not refs]:
+            if self.usage <= self.capacity:
+                break
+            logger.info("[ObjectStore.evict]: %s", key)
+            self.drop([key])
+
+    def resolve(self, kwargs):
+        for name, arg in kwargs.items():
+            if isinstance(arg, ObjectRef):
+                kwargs[name] = self.get(arg.key)
+        return kwargs
+
+    @staticmethod
+    def refs(calls):
+        return {arg.key for kwargs in calls for arg in kwargs.values() if isinstance(arg, ObjectRef)}
+
+    def missing(self, calls):
+        sources = {}
+        for kwargs in calls:
+            for arg in kwargs.values():
+                if isinstance(arg, ObjectRef) and arg.source and arg.key not in self.entries:
+                    sources.setdefault(tuple(arg.source), set()).add(arg.key)
+        return sources
@@ -0,0 +1,361 @@
+import fnmatch
+import hashlib
+import os
+import os.path
+import pickle
+import shutil
+import stat
+
+from .consts import SYNC_STATE_DIR, SYNC_CHUNK_MIN_SIZE, SYNC_CHUNK_AVG_BITS, SYNC_CHUNK_MAX_SIZE, \
+    SYNC_READ_SIZE, SYNC_BATCH_SIZE, SYNC_IGNORE_FILENAME, SYNC_DEFAULT_IGNORE, SYNC_INDEX_DIR
+
+GEAR = [int.from_bytes(hashlib.sha1(bytes([i])).digest()[:8], "big") for i in range(256)]
+GEAR_MASK = (1 << 64) - 1
+GEAR_WINDOW = 64
+BOUNDARY_MASK = ((1 << SYNC_CHUNK_AVG_BITS) - 1) << (64 - SYNC_CHUNK_AVG_BITS)
+
+try:
+    import numpy
+
+    GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64)
+except ImportError:
+    numpy = None
+
+
+def gear_candidates(data):
+    # the gear hash only sees the last GEAR_WINDOW bytes, so the hash at every offset can be built by doubling
+    hashes = GEAR_ARRAY[numpy.frombuffer(data, dtype=numpy.uint8)]
+    width = 1
+    while width < GEAR_WINDOW:
+        hashes[width:] += hashes[:-width] << numpy.uint64(width)
+        width *= 2
+    return numpy.flatnonzero((hashes & numpy.uint64(BOUNDARY_MASK)) == 0)
+
+
+def boundary(data, start, end, candidates=None):
+    fingerprint = 0
+    stop = end if candidates is None else min(start + GEAR_WINDOW - 1, end)
+    for i in range(start, stop):
+        fingerprint = ((fingerprint << 1) + GEAR[data[i]]) & GEAR_MASK
+        if not fingerprint & BOUNDARY_MASK:
+            return i + 1
+    if candidates is not None:
+        i = numpy.searchsorted(candidates, stop)
+        if i < len(candidates) and candidates[i] < end:
+            return int(candidates[i]) + 1
+    return end
+
+
+def cut_points(data, final=True, vectorised=True):
+    start, size = 0, len(data)
+    candidates = gear_candidates(data) if vectorised and numpy is not None else None
+    while size - start > SYNC_CHUNK_MIN_SIZE:
+        end = start + SYNC_CHUNK_MAX_SIZE
+        if end > size:
+            if not final:
+                return
+            end = size
+        end = boundary(data, start + SYNC_CHUNK_MIN_SIZE, end, candidates)
+        yield end
+        start = end
+    if final and start < size:
+        yield size
+
+
+def file_chunks(path, read_size=SYNC_READ_SIZE):
+    chunks, buffer = [], b""
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(read_size)
+            buffer += block
+            start = 0
+            for end in cut_points(buffer, final=not block):
+                chunks.append((hashlib.sha1(buffer[start:end]).hexdigest(), end - start))
+                start = end
+            buffer = buffer[start:]
+            if not block:
+                return chunks
+
+
+def full_path(root, rel):
+    return os.path.join(root, rel) if rel else root
+
+
+class IgnoreRules:
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self.rules = []
+        for pattern in self.patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            pattern = pattern.lstrip("!")
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            self.rules.append((pattern.lstrip("/"), negated, dir_only, anchored))
+
+    @classmethod
+    def load(cls, root):
+        patterns = list(SYNC_DEFAULT_IGNORE)
+        ignore_file = os.path.join(root, SYNC_IGNORE_FILENAME)
+        if os.path.isfile(ignore_file):
+            with open(ignore_file) as f:
+                patterns.extend(f.read().splitlines())
+        return cls(patterns)
+
+    def match(self, rel, is_dir=False):
+        ignored = False
+        for pattern, negated, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(rel if anchored else os.path.basename(rel), pattern):
+                ignored = not negated
+        return ignored
+
+
+def walk(root, rules=None):
+    if os.path.isfile(root):
+        yield "", os.stat(root)
+        return
+    rules = rules or IgnoreRules()
+    for top, dirs, files in os.walk(root):
+        rel_top = os.path.relpath(top, root)
+        rel_top = "" if rel_top == "." else rel_top
+        dirs[:] = sorted(d for d in dirs
+                         if d != SYNC_STATE_DIR and not rules.match(os.path.join(rel_top, d), True))
+        for name in dirs + sorted(f for f in files if not rules.match(os.path.join(rel_top, f))):
+            rel = os.path.join(rel_top, name)
+            try:
+                yield rel, os.lstat(os.path.join(root, rel))
+            except OSError:
+                continue
+
+
+def scan(root, cache=None, rules=None):
+    manifest, cache = {}, cache or {}
+    if not os.path.exists(root):
+        return manifest
+    for rel, st in walk(root, rules):
+        if stat.S_ISDIR(st.st_mode):
+            manifest[rel] = dict(mode=stat.S_IMODE(st.st_mode), chunks=None)
+        elif stat.S_ISLNK(st.st_mode):
+            # kept as links, whatever they point at, so a link to a directory is not followed into it
+            manifest[rel] = dict(mode=stat.S_IMODE(st.st_mode), chunks=None, link=os.readlink(full_path(root, rel)))
+        elif stat.S_ISREG(st.st_mode):
+            entry = dict(mode=stat.S_IMODE(st.st_mode), size=st.st_size, mtime=st.st_mtime_ns)
+            cached = cache.get(rel)
+            if cached and cached["chunks"] is not None and \
+                    (cached.get("size"), cached.get("mtime")) == (entry["size"], entry["mtime"]):
+                entry["chunks"] = cached["chunks"]
+            else:
+                entry["chunks"] = file_chunks(full_path(root, rel))
+            manifest[rel] = entry
+    return manifest
+
+
+def fingerprint(manifest):
+    digest = hashlib.sha1()
+    for rel in sorted(manifest):
+        entry = manifest[rel]
+        digest.update(repr((rel, entry["mode"], entry["chunks"], entry.get("link"))).encode())
+    return digest.hexdigest()
+
+
+class SyncIndex:
+    def __init__(self, path, index_dir=SYNC_INDEX_DIR):
+        self.path = path
+        self.rules = IgnoreRules() if os.path.isfile(path) else IgnoreRules.load(path)
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        self.index_file = os.path.join(index_dir, key) if index_dir else None
+        self.manifest = {}
+        if self.index_file and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "rb") as f:
+                    self.manifest = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self.manifest = {}
+
+    def scan(self):
+        self.manifest = scan(self.path, self.manifest, self.rules)
+        if self.index_file:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp_file = "{}.{}.tmp".format(self.index_file, os.getpid())
+            with open(tmp_file, "wb") as f:
+                pickle.dump(self.manifest, f)
+            os.replace(tmp_file, self.index_file)
+        return self.manifest
+
+
+def chunk_index(manifest):
+    index = {}
+    for rel, entry in manifest.items():
+        offset = 0
+        for digest, size in entry["chunks"] or ():
+            index.setdefault(digest, (rel, offset, size))
+            offset += size
+    return index
+
+
+def content(entry):
+    return {key: entry[key] for key in ("mode", "chunks", "link") if key in entry}
+
+
+def is_dir(entry):
+    return entry["chunks"] is None and "link" not in entry
+
+
+def diff(local, remote):
+    changed = {rel: content(entry) for rel, entry in local.items()
+               if rel not in remote or content(remote[rel]) != content(entry)}
+    deleted = sorted((rel for rel in remote if rel not in local), reverse=True)
+    known, missing = set(chunk_index(remote)), {}
+    for entry in changed.values():
+        for digest, size in entry["chunks"] or ():
+            if digest not in known:
+                missing[digest] = size
+    return changed, deleted, missing
+
+
+def batches(missing, batch_size=SYNC_BATCH_SIZE):
+    batch, batch_bytes = [], 0
+    for digest, size in missing.items():
+        batch.append(digest)
+        batch_bytes += size
+        if batch_bytes >= batch_size:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def read_chunk(root, location):
+    rel, offset, size = location
+    with open(full_path(root, rel), "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def read_chunks(root, manifest, digests):
+    index, chunks = chunk_index(manifest), {}
+    for digest in digests:
+        data = read_chunk(root, index[digest])
+        if hashlib.sha1(data).hexdigest() != digest:
+            raise OSError("{} changed during sync".format(index[digest][0]))
+        chunks[digest] = data
+    return chunks
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def applied(root, manifest, changed, deleted):
+    manifest = dict(manifest)
+    for rel in (*deleted, *(rel for rel, entry in changed.items() if not is_dir(entry))):
+        prefix = os.path.join(rel, "")
+        for each in [each for each in manifest if each == rel or each.startswith(prefix)]:
+            del manifest[each]
+    for rel, entry in changed.items():
+        if entry["chunks"] is None:
+            manifest[rel] = content(entry)
+        else:
+            st = os.stat(full_path(root, rel))
+            manifest[rel] = dict(mode=entry["mode"], size=st.st_size, mtime=st.st_mtime_ns, chunks=entry["chunks"])
+    return manifest
+
+
+class ManifestStore:
+    def __init__(self, path):
+        self.path = path
+        self.state_dir = os.path.join(path, SYNC_STATE_DIR)
+        self.manifest_file = os.path.join(self.state_dir, "manifests")
+        self.manifests = {}
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, "rb") as f:
+                    self.manifests = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                self.manifests = {}
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(self.manifests, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def staging_dir(self, sync_id):
+        return os.path.join(self.state_dir, "staging", str(sync_id))
+
+    def manifest(self, subpath, ignore=()):
+        manifest = scan(full_path(self.path, subpath), self.manifests.get(subpath), IgnoreRules(ignore))
+        self.manifests[subpath] = manifest
+        return manifest
+
+    def read_chunks(self, subpath, digests):
+        return read_chunks(full_path(self.path, subpath), self.manifests.get(subpath) or self.manifest(subpath), digests)
+
+    def put_chunks(self, sync_id, chunks):
+        staging_dir = self.staging_dir(sync_id)
+        os.makedirs(staging_dir, exist_ok=True)
+        for digest, data in chunks.items():
+            with open(os.path.join(staging_dir, digest), "wb") as f:
+                f.write(data)
+        return True
+
+    def apply(self, sync_id, subpath, changed, deleted, ignore=()):
+        root = full_path(self.path, subpath)
+        staging_dir = self.staging_dir(sync_id)
+        manifest = self.manifests.get(subpath)
+        if manifest is None:
+            manifest = self.manifest(subpath, ignore)
+        index = chunk_index(manifest)
+        replaced = []
+        try:
+            for rel, entry in sorted(changed.items()):
+                path = full_path(root, rel)
+                if "link" in entry:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    remove(path)
+                    os.symlink(entry["link"], path)
+                    continue
+                if entry["chunks"] is None:
+                    if not os.path.isdir(path) or os.path.islink(path):
+                        if os.path.lexists(path):
+                            os.remove(path)
+                        os.makedirs(path)
+                    os.chmod(path, entry["mode"])
+                    continue
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                tmp_path = "{}.{}.tmp".format(path, sync_id)
+                with open(tmp_path, "wb") as f:
+                    for digest, _ in entry["chunks"]:
+                        staged = os.path.join(staging_dir, digest)
+                        if os.path.exists(staged):
+                            with open(staged, "rb") as chunk:
+                                f.write(chunk.read())
+                        else:
+                            f.write(read_chunk(root, index[digest]))
+                os.chmod(tmp_path, entry["mode"])
+                replaced.append((tmp_path, path))
+            for tmp_path, path in replaced:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                os.replace(tmp_path, path)
+            replaced = []
+            for rel in deleted:
+                remove(full_path(root, rel))
+        finally:
+            for tmp_path, _ in replaced:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        if changed or deleted:
+            self.manifests[subpath] = applied(root, manifest, changed, deleted)
+            self.save()
+        return True
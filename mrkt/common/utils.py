@@ -1,12 +1,8 @@
 import inspect
 import os
-import subprocess
 import gevent
 from gevent.pool import Group
 from functools import wraps
-from lz4.frame import compress, decompress
-
-from .consts import RDIFF_SIG_FILENAME, RDIFF_DELTA_FILENAME
 
 
 def patch():
@@ -39,38 +35,6 @@ def function_index(func):
     return "{}:{}".format(get_module_name(func), func_name)
 
 
-def dir_sig(path, is_dir=True):
-    if not os.path.exists(path):
-        if is_dir:
-            os.makedirs(path)
-        else:
-            parent_dir = os.path.dirname(path)
-            if not os.path.exists(parent_dir):
-                os.makedirs(parent_dir)
-            os.mknod(path)
-    p = subprocess.run(["rdiffdir", "sig", path, "-"],
-                       stdout=subprocess.PIPE)
-    return compress(p.stdout)
-
-
-def dir_delta(sig, new_path):
-    with open(RDIFF_SIG_FILENAME, "wb") as f:
-        f.write(decompress(sig))
-    p = subprocess.run(["rdiffdir", "delta", RDIFF_SIG_FILENAME, new_path, "-"],
-                       stdout=subprocess.PIPE,
-                       input=sig)
-    os.remove(RDIFF_SIG_FILENAME)
-    return compress(p.stdout)
-
-
-def dir_patch(path, delta):
-    with open(RDIFF_DELTA_FILENAME, "wb") as f:
-        f.write(decompress(delta))
-    subprocess.run(["rdiffdir", "patch", path, RDIFF_DELTA_FILENAME])
-    os.remove(RDIFF_DELTA_FILENAME)
-    return True
-
-
 def listify(typ=list):
     def _wrapper(func):
         @wraps(func)
@@ -1,5 +1,24 @@
-from mrkt.framework.cluster.pool import Pool
-from .cluster.pool import Pool
-from .platform.local import Hosts
-from .platform.AWS import EC2
-from .service.docker import ViaSSH
\ No newline at end of file
+import importlib
+
+BACKENDS = {
+    "Pool": ".cluster.pool",
+    "RemotePool": ".cluster.scheduler",
+    "Autoscaler": ".cluster.autoscale",
+    "Hosts": ".platform.local",
+    "EC2": ".platform.AWS",
+    "ViaSSH": ".service.docker",
+    "LocalProcess": ".service.local",
+}
+
+__all__ = list(BACKENDS)
+
+
+def __getattr__(name):
+    if name not in BACKENDS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    obj = globals()[name] = getattr(importlib.import_module(BACKENDS[name], __name__), name)
+    return obj
+
+
+def __dir__():
+    return sorted(set(globals()) | set(BACKENDS))
\ No newline at end of file
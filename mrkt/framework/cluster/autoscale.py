@@ -0,0 +1,94 @@
+import math
+from logging import getLogger
+from time import time
+import gevent
+from mrkt.common.consts import *
+
+logger = getLogger(__name__)
+
+
+class Autoscaler:
+    def __init__(self, pool, platform, vm_type, min_vms=0, max_vms=PLATFORM_AUTOSCALE_MAX_VMS, spot=False,
+                 target=PLATFORM_AUTOSCALE_TARGET_SECONDS, idle_timeout=PLATFORM_AUTOSCALE_IDLE_TIMEOUT,
+                 interval=PLATFORM_AUTOSCALE_INTERVAL):
+        self.pool = pool
+        self.platform = platform
+        self.vm_type = vm_type
+        self.min_vms = min_vms
+        self.max_vms = max_vms
+        self.spot = spot
+        self.target = target
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.VMs = []
+        self.busy = {}
+        self.rate = None
+        self.completed = pool.completed
+        self.let = gevent.spawn(self.run)
+        pool.autoscalers.append(self)
+
+    def ready(self, vm):
+        return vm in self.platform.vm_services and bool(self.platform.vm_services[vm].workers)
+
+    def idle(self, vm, now):
+        workers = self.platform.vm_services[vm].workers
+        return now - self.busy.get(vm, now) > self.idle_timeout and not any(worker.tasks for worker in workers)
+
+    def observe(self):
+        rate = (self.pool.completed - self.completed) / self.interval
+        self.completed = self.pool.completed
+        self.rate = rate if self.rate is None else self.rate + PLATFORM_AUTOSCALE_SMOOTHING * (rate - self.rate)
+        now = time()
+        for vm in self.VMs:
+            if vm not in self.busy or not self.ready(vm) or \
+                    any(worker.tasks for worker in self.platform.vm_services[vm].workers):
+                self.busy[vm] = now
+
+    def wanted(self):
+        backlog = self.pool.queued()
+        if not backlog:
+            return 0
+        rate = self.rate
+        if not rate:
+            if not self.pool.capacity:
+                return 1
+            # nothing finished within an interval, so no running task finishes faster than that
+            rate = (len(self.pool.processing_tasks) or self.pool.capacity) / self.interval
+        # throughput grows with the number of VMs, so scale them by how far the backlog overshoots the target
+        vms = sum(1 for service in self.platform.vm_services.values() if service.workers)
+        return math.ceil(max(1, vms) * (backlog / rate / self.target - 1))
+
+    def scale(self):
+        self.VMs = [vm for vm in self.VMs if vm in self.platform.VMs]
+        if not all(map(self.ready, self.VMs)):
+            return
+        launch = min(self.wanted(), self.max_vms - len(self.VMs))
+        if launch > 0 or len(self.VMs) < self.min_vms:
+            launch = max(launch, self.min_vms - len(self.VMs))
+            logger.info("[Autoscaler.scale] %s queued at %.2f tasks/s, launching %s", self.pool.queued(),
+                        self.rate or 0, launch)
+            self.VMs.extend(self.platform.scale_up(self.vm_type, launch, self.spot))
+        elif not self.pool.queued():
+            now = time()
+            for vm in list(self.VMs):
+                if len(self.VMs) > self.min_vms and self.idle(vm, now):
+                    self.VMs.remove(vm)
+                    self.busy.pop(vm, None)
+                    self.platform.scale_down(vm)
+
+    def run(self):
+        while True:
+            gevent.sleep(self.interval)
+            self.observe()
+            try:
+                self.scale()
+            except Exception as e:
+                logger.warning("[Autoscaler.run] scaling %s failed: %s", self.vm_type, e)
+
+    def stop(self, scale_down=False):
+        self.let.kill()
+        if scale_down:
+            for vm in self.VMs:
+                if vm in self.platform.VMs:
+                    self.platform.scale_down(vm)
+            self.VMs = []
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import os.path
+import pickle
+from collections import OrderedDict
+from logging import getLogger
+
+from mrkt.common.port import Frame, dumps, loads
+from mrkt.common.consts import *
+
+logger = getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, capacity=POOL_CACHE_MEMORY_ITEMS, path=POOL_CACHE_DIR, disk_limit=POOL_CACHE_DISK_LIMIT):
+        self.capacity = capacity
+        self.path = path
+        self.disk_limit = disk_limit
+        self.memory = OrderedDict()
+        self.disk_usage = 0
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            self.disk_usage = sum(os.path.getsize(f) for f in self.disk_files())
+
+    @staticmethod
+    def key(func_name, kwargs, fingerprint):
+        digest = hashlib.sha256()
+        digest.update(func_name.encode())
+        digest.update(fingerprint.encode())
+        for part in dumps(kwargs).parts:
+            digest.update(part)
+        return digest.hexdigest()
+
+    def disk_file(self, key):
+        return os.path.join(self.path, key)
+
+    def disk_files(self):
+        return [os.path.join(self.path, f) for f in os.listdir(self.path)]
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return True, self.memory[key]
+        if self.path and os.path.exists(self.disk_file(key)):
+            with open(self.disk_file(key), "rb") as f:
+                serializer, parts = pickle.load(f)
+            os.utime(self.disk_file(key))
+            value = loads(Frame(serializer, parts))
+            self.remember(key, value)
+            self.hits += 1
+            return True, value
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.path:
+            frame = dumps(value)
+            disk_file = self.disk_file(key)
+            replaced = os.path.getsize(disk_file) if os.path.exists(disk_file) else 0
+            tmp_file = "{}.tmp".format(disk_file)
+            with open(tmp_file, "wb") as f:
+                pickle.dump((frame.serializer, [bytes(part) for part in frame.parts]), f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, disk_file)
+            self.disk_usage += os.path.getsize(disk_file) - replaced
+            if self.disk_usage > self.disk_limit:
+                self.evict_disk()
+
+    def remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def evict_disk(self):
+        files = sorted(self.disk_files(), key=os.path.getmtime)
+        self.disk_usage = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if self.disk_usage <= self.disk_limit * POOL_CACHE_DISK_LOW_WATER:
+                break
+            self.disk_usage -= os.path.getsize(f)
+            os.remove(f)
+        logger.info("[ResultCache.evict_disk]: %s bytes left on disk", self.disk_usage)
+
+    def clear(self):
+        self.memory.clear()
+        if self.path:
+            for f in self.disk_files():
+                os.remove(f)
+            self.disk_usage = 0
@@ -1,37 +1,428 @@
-from gevent import sleep
+import os
 from collections import deque
-from mrkt.framework.role.task import Task
+from itertools import islice
+from logging import getLogger
+from statistics import median
+from time import time
+from uuid import uuid1
+import gevent
+from gevent.queue import Queue
+from mrkt.framework.role.task import Task, BatchTask
 from mrkt.framework.role import Cluster
+from mrkt.framework.cluster.cache import ResultCache
+from mrkt.framework.cluster.stats import TaskStats
+from mrkt.common.exceptions import TaskFailure, DependencyError, ObjectUnreachable
+from mrkt.common.store import SharedObject, ObjectRef
+from mrkt.common.utils import call_on_each
 from mrkt.common.consts import *
 
+logger = getLogger(__name__)
 
-class Pool(Cluster):
-    def __init__(self, *args, **kwargs):
-        super(Pool, self).__init__(*args, **kwargs)
+
+class AutoChunker:
+    def __init__(self, target=POOL_CHUNK_TARGET_TIME, limit=POOL_CHUNK_MAX_SIZE):
+        self.target = target
+        self.limit = limit
+        self.per_call = None
+
+    def record(self, task):
+        if task.elapsed is None:
+            return
+        per_call = task.elapsed / len(task)
+        if self.per_call is None:
+            self.per_call = per_call
+        else:
+            self.per_call += POOL_CHUNK_SMOOTHING * (per_call - self.per_call)
+
+    def size(self):
+        if not self.per_call:
+            return 1
+        return max(1, min(self.limit, int(self.target / self.per_call)))
+
+
+class BasePool:
+    def launch(self, task):
+        raise NotImplementedError
+
+    def fetch(self, task):
+        raise NotImplementedError
+
+    def submit(self, func, *args, **kwargs):
+        return self.start(Task(func, args, kwargs))
+
+    def submit_batch(self, func, calls):
+        return self.start(BatchTask(func, calls))
+
+    def defer(self, func, *args, **kwargs):
+        task = Task(func, args, kwargs)
+        task.keep = [uuid1().hex]
+        return self.start(task)
+
+    def start(self, task):
+        deps = task.dependencies()
+        if not deps:
+            return self.launch(task)
+        remaining = len(deps)
+
+        def ready(_):
+            nonlocal remaining
+            remaining -= 1
+            if remaining:
+                return
+            failed = [dep for dep in deps if dep.state != Task.State.Succeed]
+            if failed:
+                task.fail(TaskFailure(DependencyError("{} depends on failed {}".format(task, failed[0]))))
+            else:
+                self.launch(task)
+
+        for dep in deps:
+            dep.finished.rawlink(ready)
+        return task
+
+    def put(self, obj):
+        return SharedObject(obj)
+
+    def submit_chunks(self, func, iterables, chunksize=1):
+        calls = ((args, {}) for args in zip(*iterables))
+        if chunksize == "auto":
+            chunker = AutoChunker()
+            probe_calls = list(islice(calls, 1))
+            if not probe_calls:
+                return
+            probe = self.submit_batch(func, probe_calls)
+            probe.join()
+            chunker.record(probe)
+            yield probe
+        else:
+            chunker = None
+        while True:
+            batch = list(islice(calls, chunker.size() if chunker else chunksize))
+            if not batch:
+                break
+            task = self.submit_batch(func, batch)
+            if chunker:
+                task.finished.rawlink(lambda _, t=task: chunker.record(t))
+            yield task
+
+    @staticmethod
+    def as_completed(tasks):
+        queue = Queue()
+        count = 0
+        for task in tasks:
+            task.finished.rawlink(lambda _, t=task: queue.put(t))
+            count += 1
+        for _ in range(count):
+            yield queue.get()
+
+    @staticmethod
+    def task_results(task):
+        return task.ret if task.ret is not None else [None] * len(task)
+
+    def stats(self):
+        return self.task_stats.snapshot()
+
+    def export_stats(self, path=None):
+        text = self.task_stats.prometheus()
+        if path:
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        return text
+
+    def pending_limit(self, max_pending=None):
+        return max_pending or POOL_PENDING_FACTOR * max(1, self.capacity)
+
+    def imap(self, func, *iterables, chunksize=1, max_pending=None):
+        chunks = self.submit_chunks(func, iterables, chunksize)
+        tasks = deque()
+        while True:
+            tasks.extend(islice(chunks, max(0, self.pending_limit(max_pending) - len(tasks))))
+            if not tasks:
+                break
+            task = tasks.popleft()
+            task.join()
+            yield from self.task_results(task)
+
+    def imap_unordered(self, func, *iterables, chunksize=1, max_pending=None):
+        chunks = self.submit_chunks(func, iterables, chunksize)
+        finished = Queue()
+        pending = 0
+        while True:
+            for task in islice(chunks, max(0, self.pending_limit(max_pending) - pending)):
+                task.finished.rawlink(lambda _, t=task: finished.put(t))
+                pending += 1
+            if not pending:
+                break
+            task = finished.get()
+            pending -= 1
+            yield from self.task_results(task)
+
+    def map(self, func, *iterables, chunksize=1, max_pending=None):
+        return self.imap(func, *iterables, chunksize=chunksize, max_pending=max_pending)
+
+
+class Pool(BasePool, Cluster):
+    def __init__(self, *args, cache=None, stats_log=None, retries=POOL_TASK_RETRIES, speculation=POOL_SPECULATION,
+                 locality_wait=POOL_LOCALITY_WAIT, **kwargs):
         self.task_queue = deque()
+        self.cache = ResultCache() if cache is True else cache
+        self.task_stats = TaskStats(stats_log)
+        self.retries = retries
+        self.speculation = speculation
+        self.durations = {}
+        self.completed = 0
+        self.unhealthy = {}
+        self.locality_wait = locality_wait
+        self.waker = None
+        self.autoscalers = []
+        super(Pool, self).__init__(*args, **kwargs)
+        self.speculator = gevent.spawn(self.speculate) if speculation else None
 
     def schedule(self):
         while True:
-            for worker in self.workers:
+            self.schedule_event.wait()
+            self.schedule_event.clear()
+            for worker in self.healthy_workers():
                 if self.need_sync(worker):
                     self.sync_worker(worker)
                 else:
                     while worker.utilization() < 1:
-                        if self.task_queue:
-                            task = self.task_queue.popleft()
-                            self.processing_tasks.append(task)
-                            task.assign_to(worker)
-                        else:
+                        task = self.next_task(worker)
+                        if task is None:
                             break
-            sleep(CLUSTER_SCHEDULE_INTERVAL)
+                        self.dispatch(task, worker)
 
-    def submit(self, func, *args, **kwargs):
-        task = Task(func, args, kwargs)
+    def dispatch(self, task, worker):
+        self.processing_tasks.add(task)
+        task.on_exit = self.task_exit
+        task.assign_to(worker)
+        task.let.link(self.notify)
+
+    def placement(self, task):
+        held = {}
+        for key, size, source in task.inputs():
+            for worker in self.workers:
+                if worker.agent_addr in task.excluded:
+                    continue
+                if worker.agent_addr == source or key in worker.objects:
+                    held[worker.agent_addr] = held.get(worker.agent_addr, 0) + size
+        return held
+
+    def wake_at(self, when):
+        if self.waker is None or self.waker.dead:
+            self.waker = gevent.spawn_later(max(0, when - time()), self.notify)
+
+    def take(self, queue, worker):
+        while queue and queue[0].cancelled:
+            queue.popleft()
+        best, best_local, now = None, -1, time()
+        for i, task in enumerate(islice(queue, POOL_LOCALITY_WINDOW)):
+            if task.cancelled or worker.agent_addr in task.excluded:
+                continue
+            if not task.inputs():
+                # nothing to place, so nothing behind it can do better than first come, first served
+                if best is None:
+                    best = i
+                break
+            held = self.placement(task)
+            local = held.get(worker.agent_addr, 0)
+            if local < max(held.values(), default=0) and now - task.stages["queued"] < self.locality_wait:
+                # most of its inputs live on another worker, leave it there unless that one stays busy
+                self.wake_at(task.stages["queued"] + self.locality_wait)
+                continue
+            if local > best_local:
+                best, best_local = i, local
+        if best is None:
+            return None
+        task = queue[best]
+        del queue[best]
+        return task
+
+    def next_task(self, worker):
+        return self.take(self.task_queue, worker)
+
+    def queued(self):
+        return len(self.task_queue)
+
+    def requeue(self, task):
+        self.task_queue.appendleft(task)
+        self.notify()
+
+    def healthy_workers(self):
+        return (worker for worker in self.workers if worker.agent_addr not in self.unhealthy)
+
+    def mark_unhealthy(self, worker):
+        if worker.agent_addr not in self.unhealthy:
+            logger.warning("[Pool.mark_unhealthy] %s is unreachable, holding it back", worker)
+            self.unhealthy[worker.agent_addr] = gevent.spawn(self.probe, worker)
+
+    def probe(self, worker):
+        interval = POOL_PROBE_INTERVAL
+        while True:
+            gevent.sleep(interval)
+            if not any(w is worker for w in self.workers):
+                break
+            if worker.probe():
+                logger.info("[Pool.probe] %s is back", worker)
+                break
+            interval = min(2 * interval, POOL_PROBE_MAX_INTERVAL)
+        del self.unhealthy[worker.agent_addr]
+        self.notify()
+
+    def worker_at(self, address):
+        for worker in self.workers:
+            if worker.agent_addr == address:
+                return worker
+
+    def task_exit(self, task):
+        self.processing_tasks.discard(task)
+        primary = task.primary or task
+        if task.cancelled or primary.finished.is_set():
+            return
+        unreachable = {key for failure in task.failures() if isinstance(failure.exception, ObjectUnreachable)
+                       for key in failure.exception.keys}
+        if unreachable and not task.relayed:
+            task.relayed = True
+            gevent.spawn(self.relay, task, unreachable)
+            return
+        self.task_stats.record(task)
+        other = primary.backup if task is primary else primary
+        if task.state == Task.State.Failed and not isinstance(task.ret, TaskFailure):
+            worker = self.worker_at(task.worker_address)
+            if worker is not None:
+                self.mark_unhealthy(worker)
+            if other is not None and other.is_pending():
+                return
+            if task.attempts < self.retries:
+                self.retry(task)
+                return
+        elif task.state == Task.State.Succeed and "acquired" in task.stages:
+            self.durations.setdefault(task.func_name, deque(maxlen=POOL_SPECULATION_WINDOW)).append(
+                task.stages["finished"] - task.stages["acquired"])
+        if other is not None and other.is_pending():
+            self.cancel(other)
+        if task is not primary:
+            primary.adopt(task)
+        if primary.cache_keys:
+            self.cache_results(primary)
+        self.completed += 1
+        primary.finished.set()
+
+    def relay(self, task, keys):
+        sources = {key: source for key, _, source in task.inputs()}
+        target = self.worker_at(task.worker_address)
+        logger.info("[Pool.relay] %s inputs of %s to %s", len(keys), task, task.worker_address)
+        try:
+            for key in keys:
+                source = self.worker_at(sources.get(key))
+                if source is None or target is None:
+                    raise OSError("no route for {} of {}".format(key, task))
+                obj = source.call("_adm_store_get", key=key)
+                target.call("_adm_store_put", key=key, frame=SharedObject(obj).frame, refs=0)
+        except Exception as e:
+            logger.warning("[Pool.relay] %s failed: %s", task, e)
+            self.task_exit(task)
+            return
+        task.reset()
+        self.dispatch(task, target)
+
+    def retry(self, task):
+        logger.warning("[Pool.retry] %s failed on %s, attempt %s", task, task.worker_address, task.attempts + 1)
+        task.attempts += 1
+        task.excluded.add(task.worker_address)
+        if all(worker.agent_addr in task.excluded for worker in self.healthy_workers()):
+            task.excluded.clear()
+        task.reset()
+        self.requeue(task)
+
+    def cancel(self, task):
+        task.cancelled = True
+        worker = self.worker_at(task.worker_address)
+        if worker and task.state == Task.State.Running:
+            gevent.spawn(worker.call, "_adm_kill", uuid=task.tid)
+
+    def speculate(self):
+        while True:
+            gevent.sleep(POOL_SPECULATION_INTERVAL)
+            now = time()
+            for task in list(self.processing_tasks):
+                durations = self.durations.get(task.func_name, ())
+                if task.primary or task.backup or task.state != Task.State.Running or \
+                        len(durations) < POOL_SPECULATION_MIN_SAMPLES:
+                    continue
+                if now - task.stages["acquired"] > self.speculation * median(durations) and \
+                        any(w.agent_addr != task.worker_address for w in self.healthy_workers()):
+                    logger.info("[Pool.speculate] backing up %s running on %s", task, task.worker_address)
+                    task.backup = task.clone()
+                    task.backup.excluded.add(task.worker_address)
+                    self.requeue(task.backup)
+
+    def look_up_cache(self, task, calls):
+        fingerprint = self.sync_manager.fingerprint()
+        hits, task.cache_keys = {}, {}
+        for i, kwargs in enumerate(calls):
+            key = self.cache.key(task.func_name, kwargs, fingerprint)
+            hit, ret = self.cache.get(key)
+            if hit:
+                hits[i] = ret
+            else:
+                task.cache_keys[i] = key
+        return hits
+
+    def cache_results(self, task):
+        if task.state != Task.State.Succeed:
+            return
+        rets = task.ret if isinstance(task, BatchTask) else [task.ret]
+        for i, key in task.cache_keys.items():
+            if not isinstance(rets[i], TaskFailure):
+                self.cache.put(key, rets[i])
+
+    def enqueue(self, task):
+        task.mark("queued")
         self.task_queue.append(task)
+        self.notify()
         return task
 
-    def map(self, func, *iterables):
-        tasks = [self.submit(func, *args) for args in zip(*iterables)]
-        for task in tasks:
-            task.join()
-            yield task.ret
+    def launch(self, task):
+        if self.cache and task.is_cacheable():
+            if isinstance(task, BatchTask):
+                task.known = self.look_up_cache(task, task.dump_all_calls())
+                if len(task.known) == len(task):
+                    task.resolve(task.load_rets([]))
+                    return task
+            else:
+                hits = self.look_up_cache(task, task.dump_calls())
+                if hits:
+                    task.resolve(hits[0])
+                    return task
+        return self.enqueue(task)
+
+    def fetch(self, task):
+        task.join()
+        if not isinstance(task.ret, ObjectRef):
+            return task.ret
+        worker = self.worker_at(task.worker_address)
+        if worker is None:
+            raise OSError("{} holding {} is gone".format(task.worker_address, task))
+        return task.load_ret(worker.call("_adm_store_get", key=task.ret.key))
+
+    def release(self, obj):
+        if isinstance(obj, Task):
+            worker = self.worker_at(obj.worker_address)
+            if worker and isinstance(obj.ret, ObjectRef):
+                worker.call("_adm_store_release", key=obj.ret.key)
+        else:
+            call_on_each(self.workers, "release_object", join=True, shared=obj)
+
+    def clean(self):
+        # stopped first, so no VM is launched into platforms that are being torn down
+        for autoscaler in self.autoscalers:
+            autoscaler.stop()
+        if self.speculator:
+            self.speculator.kill()
+        if self.waker:
+            self.waker.kill()
+        for prober in list(self.unhealthy.values()):
+            prober.kill()
+        super(Pool, self).clean()
+        self.task_stats.close()
@@ -0,0 +1,241 @@
+import argparse
+import logging
+import os
+import runpy
+import signal
+import sys
+from collections import Counter, OrderedDict, deque
+import gevent
+
+from mrkt.framework.role import Worker
+from mrkt.framework.role.task import Task
+from mrkt.framework.cluster.autoscale import Autoscaler
+from mrkt.framework.cluster.pool import BasePool, Pool
+from mrkt.framework.cluster.stats import TaskStats
+from mrkt.agent.agent import Agent
+from mrkt.common.exceptions import TaskFailure
+from mrkt.common.store import ObjectStore, ObjectRef, SharedObject
+from mrkt.common.consts import *
+
+
+class ForwardedTask(Task):
+    def __init__(self, rid, func_name, calls, objects):
+        super(ForwardedTask, self).__init__(None, func_name=func_name)
+        self.tid = rid
+        self.calls = calls
+        self.objects = objects
+
+    def shared_objects(self):
+        return self.objects
+
+    def inputs(self):
+        if self.input_refs is None:
+            refs = {arg.key: arg for kwargs in self.calls for arg in kwargs.values() if isinstance(arg, ObjectRef)}
+            self.input_refs = [(ref.key, ref.size, ref.source) for ref in refs.values()]
+        return self.input_refs
+
+    def load_rets(self, rets):
+        return rets
+
+    def failures(self):
+        return [ret for ret in self.ret or () if isinstance(ret, TaskFailure)]
+
+
+class FairPool(Pool):
+    def __init__(self, *args, **kwargs):
+        super(FairPool, self).__init__(*args, **kwargs)
+        self.queues = OrderedDict()
+        self.running = Counter()
+
+    def enqueue(self, task, job=None):
+        task.job = job
+        task.counted = False
+        task.mark("queued")
+        self.queues.setdefault(job, deque()).append(task)
+        self.notify()
+        return task
+
+    def next_task(self, worker):
+        for job in sorted((job for job, queue in self.queues.items() if queue), key=lambda j: self.running[j]):
+            task = self.take(self.queues[job], worker)
+            if task is not None:
+                self.queues.move_to_end(job)
+                return task
+        return None
+
+    def dispatch(self, task, worker):
+        self.running[task.job] += 1
+        task.counted = True
+        super(FairPool, self).dispatch(task, worker)
+
+    def queued(self):
+        return sum(map(len, self.queues.values()))
+
+    def requeue(self, task):
+        if task.job in self.queues:
+            self.queues[task.job].appendleft(task)
+            self.notify()
+        else:
+            (task.primary or task).finished.set()
+
+    def task_exit(self, task):
+        # relays exit a task twice per dispatch, so only the first exit after a dispatch counts
+        if task.counted:
+            task.counted = False
+            self.running[task.job] -= 1
+        super(FairPool, self).task_exit(task)
+
+    def drop(self, job):
+        for task in self.queues.pop(job, ()):
+            task.finished.set()
+
+
+class Scheduler(Agent):
+    def __init__(self, platforms, **options):
+        super(Scheduler, self).__init__()
+        self.pool = FairPool(platforms, **options)
+        self.objects = {}
+        self.locations = {}
+
+    def _adm_cpu_count(self):
+        return self.pool.capacity
+
+    def _adm_synced_layers(self):
+        return []
+
+    def find_worker(self, uuid):
+        for task in self.pool.processing_tasks:
+            if task.tid == uuid:
+                return self.pool.worker_at(task.worker_address)
+
+    def _adm_suspend(self, uuid):
+        worker = self.find_worker(uuid)
+        return worker.call("_adm_suspend", uuid=uuid) if worker else True
+
+    def _adm_resume(self, uuid):
+        worker = self.find_worker(uuid)
+        return worker.call("_adm_resume", uuid=uuid) if worker else True
+
+    def _adm_kill(self, uuid):
+        worker = self.find_worker(uuid)
+        return worker.call("_adm_kill", uuid=uuid) if worker else True
+
+    def _adm_store_put(self, key, frame):
+        if key not in self.objects:
+            self.objects[key] = [SharedObject.from_frame(key, frame), 0]
+        self.objects[key][1] += 1
+        return True
+
+    def _adm_store_release(self, key):
+        if key in self.objects:
+            self.objects[key][1] -= 1
+            if not self.objects[key][1]:
+                self.pool.release(self.objects.pop(key)[0])
+        elif key in self.locations:
+            worker = self.pool.worker_at(self.locations.pop(key))
+            if worker:
+                worker.call("_adm_store_release", key=key)
+        return True
+
+    def _adm_store_get(self, key):
+        return self.pool.worker_at(self.locations[key]).call("_adm_store_get", key=key)
+
+    def look_up_function(self, index):
+        if index.startswith("_adm_"):
+            return super(Scheduler, self).look_up_function(index)
+        return index
+
+    def connection_handler(self, port):
+        try:
+            super(Scheduler, self).connection_handler(port)
+        finally:
+            self.pool.drop(port)
+
+    def request_handler(self, port, rid, index, calls, keep=None):
+        if index.startswith("_adm_"):
+            return super(Scheduler, self).request_handler(port, rid, index, calls, keep)
+        objects = {key: self.objects[key][0] for key in ObjectStore.refs(calls) if key in self.objects}
+        for kwargs in calls:
+            for arg in kwargs.values():
+                if isinstance(arg, ObjectRef) and arg.key in self.locations:
+                    arg.source = self.locations[arg.key]
+        task = ForwardedTask(rid, index, calls, objects)
+        task.keep = keep
+        self.pool.enqueue(task, port)
+        task.join()
+        span = None
+        if task.state == Task.State.Succeed:
+            rets = task.ret
+            for key, ret in zip(keep or (), rets):
+                if isinstance(ret, ObjectRef):
+                    self.locations[key] = task.worker_address
+            if "remote_start" in task.stages:
+                span = task.stages["remote_start"], task.stages["remote_end"]
+        else:
+            rets = [TaskFailure(OSError("{} was lost by the scheduler".format(index)))] * len(calls)
+        try:
+            port.write((rid, rets, span))
+        except OSError:
+            logging.warning("[%s.request_handler]: lost reply of %s", self.__class__.__name__, index)
+
+    @classmethod
+    def launch(cls):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("config", type=str,
+                            help="python file defining `platforms` and optionally `options` for the pool "
+                                 "and `autoscale` settings")
+        parser.add_argument("-p", "--port", type=int,
+                            help="port", default=SCHEDULER_PORT)
+        parser.add_argument("-l", "--logging", type=str,
+                            help="Logging level", default="warning")
+        args = parser.parse_args()
+        logging.basicConfig(level=getattr(logging, args.logging.upper()))
+        sys.path.insert(1, os.getcwd())
+        config = runpy.run_path(args.config)
+        scheduler = cls(config["platforms"], **config.get("options", {}))
+        for options in config.get("autoscale", ()):
+            Autoscaler(scheduler.pool, **options)
+        gevent.signal_handler(signal.SIGTERM, gevent.getcurrent().throw, SystemExit)
+        try:
+            scheduler.run(port=args.port)
+        finally:
+            scheduler.pool.clean()
+
+
+class RemotePool(BasePool):
+    def __init__(self, addr=("127.0.0.1", SCHEDULER_PORT), max_pending=SCHEDULER_CLIENT_MAX_PENDING,
+                 compression=PORT_COMPRESSION, compression_threshold=PORT_COMPRESSION_THRESHOLD, stats_log=None):
+        self.worker = Worker(addr, max_pending, compression, compression_threshold)
+        self.task_stats = TaskStats(stats_log)
+
+    @property
+    def capacity(self):
+        return self.worker.capacity
+
+    def launch(self, task):
+        task.assign_to(self.worker)
+        task.let.link(lambda _: self.task_stats.record(task))
+        return task
+
+    def fetch(self, task):
+        task.join()
+        if not isinstance(task.ret, ObjectRef):
+            return task.ret
+        return task.load_ret(self.worker.call("_adm_store_get", key=task.ret.key))
+
+    def release(self, obj):
+        if isinstance(obj, Task):
+            if isinstance(obj.ret, ObjectRef):
+                self.worker.call("_adm_store_release", key=obj.ret.key)
+        else:
+            self.worker.release_object(obj)
+
+    def clean(self):
+        self.worker.clean()
+        self.task_stats.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clean()
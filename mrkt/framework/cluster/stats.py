@@ -0,0 +1,132 @@
+import json
+from bisect import bisect_left
+from collections import Counter
+
+from mrkt.common.consts import *
+
+INTERVALS = (
+    ("queue", "queued", "assigned"),
+    ("wait", "assigned", "acquired"),
+    ("connect", "acquired", "connected"),
+    ("serialize", "connected", "serialized"),
+    ("send", "serialized", "sent"),
+    ("remote", "remote_start", "remote_end"),
+    ("deserialize", "received", "deserialized"),
+    ("load", "deserialized", "finished"),
+    ("total", "queued", "finished"),
+)
+
+
+def intervals(stages):
+    durations = {name: stages[end] - stages[start] for name, start, end in INTERVALS
+                 if start in stages and end in stages}
+    if "remote" in durations and "received" in stages:
+        # remote timestamps come from the agent's clock, so only its duration is comparable
+        durations["network"] = max(0, stages["received"] - stages["sent"] - durations["remote"])
+    return durations
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def cumulative(self):
+        seen = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            seen += count
+            yield bound, seen
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum, max=self.max,
+                    mean=self.sum / self.count if self.count else 0,
+                    p50=self.quantile(0.5), p90=self.quantile(0.9), p99=self.quantile(0.99))
+
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class TaskStats:
+    GROUPS = ("worker", "function")
+
+    def __init__(self, log=None):
+        self.seconds = {}
+        self.bytes = {}
+        self.saved = Counter()
+        self.states = Counter()
+        self.own_log = isinstance(log, str)
+        self.log = open(log, "a", buffering=1) if self.own_log else log
+
+    @staticmethod
+    def observe(histograms, key, value, buckets):
+        if key not in histograms:
+            histograms[key] = Histogram(buckets)
+        histograms[key].observe(value)
+
+    def record(self, task):
+        durations = intervals(task.stages)
+        worker = "{}:{}".format(*task.worker_address) if task.worker_address else None
+        for group in zip(self.GROUPS, (worker, task.func_name)):
+            self.states[(*group, task.state.name)] += 1
+            for stage, seconds in durations.items():
+                self.observe(self.seconds, (*group, stage), seconds, POOL_STATS_SECONDS_BUCKETS)
+            for direction, (raw, wire) in (("out", task.bytes_out), ("in", task.bytes_in)):
+                self.observe(self.bytes, (*group, direction), wire, POOL_STATS_BYTES_BUCKETS)
+                self.observe(self.bytes, (*group, direction + "_raw"), raw, POOL_STATS_BYTES_BUCKETS)
+            self.saved[group] += task.bytes_saved
+        if self.log:
+            self.log.write(json.dumps(dict(tid=task.tid, function=task.func_name, worker=worker,
+                                           state=task.state.name, stages=task.stages, durations=durations,
+                                           bytes_out=task.bytes_out, bytes_in=task.bytes_in)) + "\n")
+
+    def snapshot(self):
+        snapshot = {group: {} for group in self.GROUPS}
+        for (group, key, state), count in self.states.items():
+            snapshot[group].setdefault(key, {}).setdefault("tasks", {})[state] = count
+        for (group, key), saved in self.saved.items():
+            snapshot[group][key]["bytes_saved"] = saved
+        for kind, histograms in (("seconds", self.seconds), ("bytes", self.bytes)):
+            for (group, key, name), hist in histograms.items():
+                snapshot[group][key].setdefault(kind, {})[name] = hist.snapshot()
+        return snapshot
+
+    def prometheus(self):
+        lines = ["# TYPE mrkt_tasks_total counter"]
+        for (group, key, state), count in sorted(self.states.items(), key=str):
+            lines.append('mrkt_tasks_total{{{}="{}",state="{}"}} {}'.format(group, label(key), state, count))
+        for metric, name, histograms in (("mrkt_task_seconds", "stage", self.seconds),
+                                         ("mrkt_task_bytes", "direction", self.bytes)):
+            lines.append("# TYPE {} histogram".format(metric))
+            for (group, key, value), hist in sorted(histograms.items(), key=str):
+                labels = '{}="{}",{}="{}"'.format(group, label(key), name, value)
+                for bound, count in hist.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(metric, labels, bound, count))
+                lines.append("{}_sum{{{}}} {}".format(metric, labels, hist.sum))
+                lines.append("{}_count{{{}}} {}".format(metric, labels, hist.count))
+        lines.append("# TYPE mrkt_task_bytes_saved gauge")
+        for (group, key), saved in sorted(self.saved.items(), key=str):
+            lines.append('mrkt_task_bytes_saved{{{}="{}"}} {}'.format(group, label(key), saved))
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self.own_log and self.log:
+            self.log.close()
+        self.log = None
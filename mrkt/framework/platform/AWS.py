@@ -1,8 +1,11 @@
 from ...common.utils import patch;
 
 patch()
-import boto3
+import json
+import os
+import os.path
 import urllib.request
+from time import time
 
 from .PaaS import PaaS
 from ..service import docker
@@ -15,9 +18,27 @@ VM_TAG = [{"ResourceType": "instance",
                              "Value": "True"}]}]
 
 
-def fetch_coreos_ami(region):
+def fetch_coreos_ami(region, cache_file=PLATFORM_EC2_AMI_CACHE, ttl=PLATFORM_EC2_AMI_TTL):
+    cache = {}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    ami, fetched = cache.get(region, (None, 0))
+    if ami and time() - fetched < ttl:
+        return ami
     url = COREOS_AMI_URL.format(region=region)
-    return urllib.request.urlopen(url).read().decode().strip()
+    ami = urllib.request.urlopen(url).read().decode().strip()
+    if cache_file:
+        cache[region] = (ami, time())
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+    return ami
 
 
 class EC2(PaaS):
@@ -27,6 +48,8 @@ class EC2(PaaS):
                  placement_group=None,
                  region=PLATFORM_EC2_REGION,
                  clean_action=PaaS.CleanAction.Stop,
+                 spot_price=None,
+                 ec2_resource=None,
                  **options):
         super(EC2, self).__init__(requests, clean_action, **options)
         self.sgroup = sgroup
@@ -35,22 +58,32 @@ class EC2(PaaS):
         self.key_file = key_file
         self.username = username
         self.placement = {"GroupName": placement_group} if placement_group else {}
-        self.ec2_client = boto3.resource("ec2", region_name=region)
+        self.spot_price = spot_price
+        if ec2_resource is None:
+            import boto3
+            ec2_resource = boto3.resource("ec2", region_name=region)
+        self.ec2_client = ec2_resource
 
-    def VMs_on_platform(self):
+    def VMs_on_platform(self, vm_types=None):
         filters = [
             {"Name":   "instance-state-name",
              'Values': ["running", "stopped"]},
             {"Name":   "image-id",
              'Values': [self.ami]},
             {"Name":   "instance-type",
-             "Values": list(self.requests.keys())},
+             "Values": list(vm_types or self.requests.keys())},
             {"Name":   "tag:{}".format(PLATFORM_EC2_VM_TAG),
              "Values": ["True"]}
         ]
         return self.ec2_client.instances.filter(Filters=filters)
 
-    def launch_VMs(self, vm_type, vm_num):
+    def launch_VMs(self, vm_type, vm_num, spot=False):
+        market = {}
+        if spot:
+            spot_options = {"SpotInstanceType": "one-time", "InstanceInterruptionBehavior": "terminate"}
+            if self.spot_price:
+                spot_options["MaxPrice"] = str(self.spot_price)
+            market = {"InstanceMarketOptions": {"MarketType": "spot", "SpotOptions": spot_options}}
         return self.ec2_client.create_instances(ImageId=self.ami,
                                                 InstanceType=vm_type,
                                                 MinCount=vm_num,
@@ -58,12 +91,22 @@ class EC2(PaaS):
                                                 KeyName=self.key_name,
                                                 Placement=self.placement,
                                                 SecurityGroupIds=[self.sgroup],
-                                                TagSpecifications=VM_TAG)
+                                                TagSpecifications=VM_TAG,
+                                                **market)
 
     def VM_is_ready(self, vm):
         vm.load()
         return vm.state["Name"] == "running"
 
+    def VMs_ready(self, vms):
+        pending, ready = {vm.id: vm for vm in vms}, []
+        for instance in self.ec2_client.instances.filter(InstanceIds=list(pending)):
+            if instance.state["Name"] == "running":
+                vm = pending[instance.id]
+                vm.meta.data = instance.meta.data
+                ready.append(vm)
+        return ready
+
     def service_on_VM(self, vm):
         return docker.ViaSSH(vm.public_dns_name,
                              username=self.username,
@@ -71,4 +114,5 @@ class EC2(PaaS):
 
     def clean_VM(self, vm):
         if self.clean_action != self.CleanAction.Null:
-            getattr(vm, self.clean_action)()
+            # one-time spot instances cannot be stopped
+            getattr(vm, "terminate" if vm.instance_lifecycle == "spot" else self.clean_action)()
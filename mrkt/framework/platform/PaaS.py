@@ -2,6 +2,7 @@ from ...common.utils import patch;
 
 patch()
 import gevent
+from gevent.event import Event
 from gevent.pool import Group
 from copy import copy
 from logging import getLogger
@@ -24,16 +25,23 @@ class PaaS(Platform):
         self.requests = requests
         self.clean_action = clean_action
         self.pending_lets = Group()
+        self.vm_services = {}
+        self.service_options = None
+        self.pending_VMs = {}
+        self.poller = None
 
-    def VMs_on_platform(self):
+    def VMs_on_platform(self, vm_types=None):
         raise NotImplementedError
 
-    def launch_VMs(self, vm_type, vm_num):
+    def launch_VMs(self, vm_type, vm_num, spot=False):
         raise NotImplementedError
 
     def VM_is_ready(self, vm):
         raise NotImplementedError
 
+    def VMs_ready(self, vms):
+        return [vm for vm in vms if self.VM_is_ready(vm)]
+
     def service_on_VM(self, vm):
         raise NotImplementedError
 
@@ -68,22 +76,79 @@ class PaaS(Platform):
                 self.VMs.extend(self.launch_VMs(vm_type, vm_num))
         return self.VMs
 
+    def poll_VMs(self):
+        while self.pending_VMs:
+            try:
+                for vm in self.VMs_ready(list(self.pending_VMs)):
+                    self.pending_VMs.pop(vm).set()
+            except Exception as e:
+                logger.warning("[%s.poll_VMs]: %s", self.__class__.__name__, e)
+            if self.pending_VMs:
+                gevent.sleep(PLATFORM_PAAS_VM_WAIT_INTERVAL)
+
+    def wait_until_ready(self, vm):
+        ready = self.pending_VMs.setdefault(vm, Event())
+        if self.poller is None or self.poller.dead:
+            self.poller = gevent.spawn(self.poll_VMs)
+        ready.wait()
+
+    def detach_service(self, vm):
+        service = self.vm_services.pop(vm, None)
+        if service in self.services:
+            self.services.remove(service)
+        return service
+
     def create_service(self, vm, options):
-        while not self.VM_is_ready(vm):
-            gevent.sleep(PLATFORM_PAAS_VM_WAIT_INTERVAL)
+        self.wait_until_ready(vm)
+        if vm not in self.VMs:
+            return
         service = self.service_on_VM(vm)
         service.set_options(
             dict(retry_ssh=PLATFORM_PAAS_SSH_RETRIES,
                  retry_ssh_interval=PLATFORM_PAAS_SSH_RETRY_INTERVAL),
             options,
             self.options)
-        service.prepare_workers()
+        # registered up front, so the cluster sees the workers as soon as start_workers announces them
+        self.vm_services[vm] = service
         self.services.append(service)
+        try:
+            service.prepare_workers()
+        except BaseException:
+            self.detach_service(vm)
+            raise
+        if vm not in self.VMs:
+            service.clean()
 
     def prepare_services(self, options):
+        self.service_options = options
         for vm in self.prepare_VMs():
             self.pending_lets.spawn(self.create_service, vm, options)
 
+    def scale_up(self, vm_type, vm_num, spot=False):
+        vms = []
+        if not spot:
+            for vm in self.VMs_on_platform([vm_type]):
+                if len(vms) < vm_num and vm not in self.VMs and vm.state["Name"] == "stopped":
+                    vm.start()
+                    vms.append(vm)
+        if len(vms) < vm_num:
+            vms.extend(self.launch_VMs(vm_type, vm_num - len(vms), spot))
+        logger.info("[%s.scale_up]: %s x %s%s", self.__class__.__name__, len(vms), vm_type, " (spot)" if spot else "")
+        self.VMs.extend(vms)
+        for vm in vms:
+            self.pending_lets.spawn(self.create_service, vm, self.service_options)
+        return vms
+
+    def scale_down(self, vm):
+        logger.info("[%s.scale_down]: %s", self.__class__.__name__, vm)
+        self.VMs.remove(vm)
+        if vm in self.pending_VMs:
+            self.pending_VMs.pop(vm).set()
+        service = self.detach_service(vm)
+        if service is not None:
+            service.clean()
+        self.clean_VM(vm)
+
     def clean(self):
         self.pending_lets.join()
         call_on_each(self.services, "clean", join=True)
@@ -2,4 +2,4 @@ from .cluster import Cluster
 from .platform import Platform
 from .service import Service
 from .worker import Worker
-from .task import Task
\ No newline at end of file
+from .task import Task, BatchTask
\ No newline at end of file
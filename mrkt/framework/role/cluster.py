@@ -2,45 +2,89 @@ from ...common import patch;
 
 patch()
 import gevent
+from gevent.event import Event
 from gevent.pool import Group
 
-from ...common import call_on_each
+from ...common import call_on_each, sync
 from ...common.consts import *
 
 
+class SourcePool:
+    def __init__(self, fanout=None):
+        self.fanout = fanout
+        self.sources = {}
+        self.uploads = {}
+        self.changed = Event()
+
+    def acquire(self, key):
+        while self.fanout:
+            for source in [None] + self.sources.get(key, []):
+                if self.uploads.get((key, source), 0) < self.fanout:
+                    self.uploads[(key, source)] = self.uploads.get((key, source), 0) + 1
+                    return source
+            self.changed.clear()
+            self.changed.wait()
+
+    def release(self, key, source, finished=None):
+        if (key, source) in self.uploads:
+            self.uploads[(key, source)] -= 1
+        if finished is not None:
+            self.sources.setdefault(key, []).append(finished)
+        self.changed.set()
+
+    def discard(self, source):
+        self.retain(lambda each: each is not source)
+
+    def retain(self, alive):
+        self.sources = {key: [source for source in sources if alive(source)] for key, sources in self.sources.items()}
+        self.changed.set()
+
+
 class SyncStack:
     class SyncLayer:
-        def __init__(self, path):
+        def __init__(self, path, index):
             self.path = path
-            self.delta = None
+            self.ignore = index.rules.patterns
+            self.manifest = index.scan()
+            self.fingerprint = sync.fingerprint(self.manifest)
 
-    def __init__(self):
+    def __init__(self, on_synced=None, fanout=None):
         self.layers = []
-        self.latest_tag = 0
+        self.indexes = {}
+        self.sources = SourcePool(fanout)
         self.sync_group = Group()
+        self.on_synced = on_synced
 
     def append(self, path):
-        self.layers.append(self.SyncLayer(path))
+        if path not in self.indexes:
+            self.indexes[path] = sync.SyncIndex(path)
+        self.layers.append(self.SyncLayer(path, self.indexes[path]))
 
-    def has_unknown_delta(self):
-        return self.latest_tag < len(self.layers)
+    def fingerprint(self):
+        return ",".join(layer.fingerprint for layer in self.layers)
 
     def need_sync(self, worker):
-        return worker.sync_tag < self.latest_tag
-
-    def update_delta(self, worker):
-        assert self.has_unknown_delta()
-        assert worker.sync_tag == self.latest_tag
-        layer = self.layers[self.latest_tag]
-        layer.delta = worker.calc_dir_delta(layer.path)
-        self.latest_tag += 1
+        return worker.sync_tag < len(self.layers)
 
     def start_sync(self, worker):
         def _sync():
-            while worker.sync_tag < self.latest_tag:
-                layer = self.layers[worker.sync_tag]
-                worker.sync_with_delta(layer.delta, layer.path)
+            while worker.sync_tag < len(self.layers):
+                tag = worker.sync_tag
+                layer = self.layers[tag]
+                if worker.is_synced([each.fingerprint for each in self.layers[:tag + 1]]):
+                    worker.sync_tag += 1
+                    continue
+                source, synced = self.sources.acquire(tag), None
+                try:
+                    if not worker.sync_with_manifest(layer.manifest, layer.path, source, layer.ignore,
+                                                     layer.fingerprint) and source is not None:
+                        self.sources.discard(source)
+                    synced = worker
+                finally:
+                    self.sources.release(tag, source, synced)
             worker.set_syncing(False)
+            if self.on_synced:
+                self.on_synced()
 
         worker.set_syncing(True)
         self.sync_group.spawn(_sync)
@@ -56,15 +100,26 @@ class Cluster:
     def schedule(self):
         raise NotImplementedError
 
-    def __init__(self, platforms, sync_current_dir=CLUSTER_SYNC_CURRENT_DIR, **options):
+    def __init__(self, platforms, sync_current_dir=CLUSTER_SYNC_CURRENT_DIR, sync_fanout=CLUSTER_SYNC_FANOUT,
+                 image_fanout=CLUSTER_IMAGE_FANOUT, **options):
         self.platforms = platforms
-        self.processing_tasks = []
-        self.sync_manager = SyncStack()
+        self.processing_tasks = set()
+        self.schedule_event = Event()
+        self.sync_manager = SyncStack(on_synced=self.notify, fanout=sync_fanout)
+        options = dict(options, worker_listener=self.workers_changed, image_sources=SourcePool(image_fanout))
         call_on_each(self.platforms, "prepare_services", options=options)
         self.scheduler = gevent.spawn(self.schedule)
         if sync_current_dir:
             self.sync_dir(".")
 
+    def notify(self, *_):
+        self.schedule_event.set()
+
+    def workers_changed(self, *_):
+        workers = set(self.workers)
+        self.sync_manager.sources.retain(lambda worker: worker in workers)
+        self.notify()
+
     def clean(self):
         self.scheduler.kill()
         self.sync_manager.stop()
@@ -83,16 +138,17 @@ class Cluster:
                 for worker in service.workers:
                     yield worker
 
+    @property
+    def capacity(self):
+        return sum(worker.capacity for worker in self.workers)
+
     def sync_dir(self, path):
         self.sync_manager.append(path)
+        self.notify()
 
     def need_sync(self, worker):
-        return worker.is_syncing() or self.sync_manager.need_sync(worker) or self.sync_manager.has_unknown_delta()
+        return worker.is_syncing() or self.sync_manager.need_sync(worker)
 
     def sync_worker(self, worker):
-        if not worker.is_syncing():
-            if self.sync_manager.need_sync(worker):
-                self.sync_manager.start_sync(worker)
-            elif self.sync_manager.has_unknown_delta():
-                self.sync_manager.update_delta(worker)
-                self.sync_manager.start_sync(worker)
+        if not worker.is_syncing() and self.sync_manager.need_sync(worker):
+            self.sync_manager.start_sync(worker)
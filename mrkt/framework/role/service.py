@@ -1,3 +1,4 @@
+import hashlib
 import os
 import os.path
 
@@ -19,13 +20,28 @@ class Service:
     def install_image_via_name(self, image_name):
         raise NotImplementedError
 
+    def install_image_from_peer(self, peer, image_name):
+        raise NotImplementedError
+
     def uninstall_images(self, images):
         raise NotImplementedError
 
+    def image_id(self, image_name):
+        raise NotImplementedError
+
+    def archive_image_id(self, archive):
+        raise NotImplementedError
+
     def existing_containers(self):
         raise NotImplementedError
 
-    def start_containers(self, out_port):
+    def running_containers(self):
+        raise NotImplementedError
+
+    def start_containers(self, out_port, cpus=None, mems=None, config=None):
+        raise NotImplementedError
+
+    def cpu_topology(self):
         raise NotImplementedError
 
     def kill_containers(self, dockers=None):
@@ -40,6 +56,33 @@ class Service:
         self.image_archive = SERVICE_IMAGE_ARCHIVE
         self.image_update = SERVICE_IMAGE_UPDATE
         self.image_clean = SERVICE_IMAGE_CLEAN
+        self.agent_prefork = SERVICE_AGENT_PREFORK
+        self.agent_max_tasks_per_child = AGENT_MAX_TASKS_PER_CHILD
+        self.containers_per_host = SERVICE_CONTAINERS_PER_HOST
+        self.cpu_pinning = SERVICE_CPU_PINNING
+        self.keep_warm = SERVICE_KEEP_WARM
+        self.agent_idle_timeout = SERVICE_AGENT_IDLE_TIMEOUT
+        self.worker_listener = None
+        self.image_sources = None
+        self.compression = PORT_COMPRESSION
+        self.compression_threshold = PORT_COMPRESSION_THRESHOLD
+
+    def agent_options(self):
+        options = []
+        if self.agent_prefork is not None:
+            options.append("--prefork {} --max-tasks-per-child {}".format(self.agent_prefork,
+                                                                          self.agent_max_tasks_per_child))
+        if self.keep_warm and self.agent_idle_timeout:
+            options.append("--idle-timeout {}".format(self.agent_idle_timeout))
+        return " ".join(options)
+
+    @staticmethod
+    def container_name(port):
+        return "{}_{}".format(SERVICE_CONTAINER_PREFIX, port)
+
+    def container_config(self, cpus, mems):
+        config = (self.image_id(self.image) or self.image, self.agent_options(), cpus, mems)
+        return hashlib.sha1(repr(config).encode()).hexdigest()[:16]
 
     def set_options(self, *options_list):
         for options in options_list:
@@ -57,23 +100,67 @@ class Service:
     def clean(self):
         if self.workers:
             self.stop_workers()
-        if self.image and self.image_clean:
+        if self.image and self.image_clean and not self.keep_warm:
             self.uninstall_images([self.image])
             self.image = None
 
-    def start_workers(self, num=1):
+    @staticmethod
+    def split_cpus(topology, num, numa=False):
+        def share(cpus, k, n):
+            # more containers than cores: neighbours share a core rather than running unpinned
+            return cpus[len(cpus) * k // n:len(cpus) * (k + 1) // n] or cpus[len(cpus) * k // n:][:1]
+
+        if not topology:
+            return [(None, None)] * num
+        if not numa:
+            cpus = [cpu for cpu, _ in sorted(topology, key=lambda t: (t[1], t[0]))]
+            return [(share(cpus, i, num), None) for i in range(num)]
+        nodes = sorted({node for _, node in topology})
+        assigned = [nodes[i % len(nodes)] for i in range(num)]
+        cpu_sets = []
+        for i, node in enumerate(assigned):
+            cpus = [cpu for cpu, n in topology if n == node]
+            cpu_sets.append((share(cpus, assigned[:i].count(node), assigned.count(node)), node))
+        return cpu_sets
+
+    def container_cpus(self, num):
+        if not self.cpu_pinning or num < 2:
+            return [(None, None)] * num
+        return self.split_cpus(self.cpu_topology(), num, self.cpu_pinning == "numa")
+
+    def start_workers(self, num=None):
+        num = num or self.containers_per_host
+        ports = [self.worker_port + i for i in range(num)]
+        cpu_sets = self.container_cpus(num)
+        configs = [self.container_config(cpus, mems) for cpus, mems in cpu_sets]
+        running = self.running_containers() if self.keep_warm else {}
+        warm = {self.container_name(port) for port, config in zip(ports, configs)
+                if running.get(self.container_name(port)) == config}
         ex_containers = [c for c in self.existing_containers()
-                         if c.startswith(SERVICE_CONTAINER_PREFIX)]
-        self.kill_containers(ex_containers)
-        self.containers = [self.start_containers(AGENT_PORT)]
-        self.workers = [Worker((self.address, self.worker_port)) for _ in range(num)]
+                         if c.startswith(SERVICE_CONTAINER_PREFIX) and c not in warm]
+        if ex_containers:
+            self.kill_containers(ex_containers)
+        self.containers = [self.container_name(port) if self.container_name(port) in warm
+                           else self.start_containers(port, cpus, mems, config)
+                           for port, (cpus, mems), config in zip(ports, cpu_sets, configs)]
+        self.workers = [Worker((self.address, port),
+                               compression=self.compression,
+                               compression_threshold=self.compression_threshold)
+                        for port in ports]
+        if self.worker_listener:
+            self.worker_listener(self.workers)
         return self.workers
 
     def stop_workers(self):
         for worker in self.workers:
             worker.clean()
         self.workers = []
-        self.kill_containers()
+        if self.image_sources is not None:
+            self.image_sources.discard(self)
+        if self.worker_listener:
+            self.worker_listener(self.workers)
+        if not self.keep_warm:
+            self.kill_containers()
 
     def image_exists(self, name):
         for image in self.existing_images():
@@ -85,14 +172,37 @@ class Service:
                 return True
         return False
 
+    def distribute_image(self, key, install):
+        if self.image_sources is None:
+            return install()
+        source, image = self.image_sources.acquire(key), None
+        try:
+            if source is not None:
+                image = self.install_image_from_peer(source, source.image)
+                if not image:
+                    self.image_sources.discard(source)
+            if not image:
+                image = install()
+            return image
+        finally:
+            self.image_sources.release(key, source, self if image else None)
+
     def install_image(self):
         if self.image_archive:
             image_name = os.path.basename(self.image_archive).split(".")[0]
-            if not self.image_exists(image_name) or self.image_update:
-                self.image = self.install_image_via_archive(self.image_archive)
+            image_id = self.archive_image_id(self.image_archive)
+            if image_id:
+                outdated = self.image_id(image_name) != image_id
+            else:
+                outdated = not self.image_exists(image_name) or self.image_update
+            if outdated:
+                self.image = self.distribute_image(image_id or self.image_archive,
+                                                   lambda: self.install_image_via_archive(self.image_archive))
+            else:
+                self.image = image_name
         elif self.image:
             if not self.image_exists(self.image) or self.image_update:
-                self.image = self.install_image_via_name(self.image)
+                self.image = self.distribute_image(self.image, lambda: self.install_image_via_name(self.image))
         else:
             raise AttributeError
         outdated_images = self.existing_images(only_outdated=True)
@@ -1,11 +1,14 @@
+import copy
 import inspect
 import gevent
+from gevent.event import Event
 from enum import Enum
+from time import time
+from uuid import uuid1
 
 from mrkt.common.exceptions import TaskFailure
-from mrkt.common.port import ObjPort
+from mrkt.common.store import SharedObject, ObjectRef
 from mrkt.common.utils import function_index
-from mrkt.common.consts import *
 
 
 class Task:
@@ -17,20 +20,69 @@ class Task:
         self.args = (args or [], kwargs or {})
         self.state = Task.State.Waiting
         self.worker_address = None
-        self.port = None
         self.let = None
-        self.tid = None
+        self.finished = Event()
+        self.tid = uuid1().int
         self.ret = None
-        self.debug_stat = 0
+        self.calls = None
+        self.cache_keys = None
+        self.elapsed = None
+        self.bytes_out = (0, 0)
+        self.bytes_in = (0, 0)
+        self.stages = dict(queued=time())
+        self.on_exit = None
+        self.attempts = 0
+        self.excluded = set()
+        self.primary = None
+        self.backup = None
+        self.cancelled = False
+        self.keep = None
+        self.input_refs = None
+        self.relayed = False
 
-    def clean(self):
-        if self.port:
-            self.port.close()
+    @property
+    def bytes_saved(self):
+        return self.bytes_out[0] - self.bytes_out[1] + self.bytes_in[0] - self.bytes_in[1]
+
+    def mark(self, stage):
+        self.stages[stage] = time()
 
     def assign_to(self, worker):
+        self.mark("assigned")
         self.worker_address = worker.agent_addr
         worker.tasks.add(self)
-        self.let = gevent.spawn(self.execute, worker, *self.args)
+        self.let = gevent.spawn(self.execute, worker)
+        self.let.link(self.exit)
+
+    def exit(self, _):
+        if self.on_exit:
+            self.on_exit(self)
+        else:
+            self.finished.set()
+
+    def reset(self):
+        self.state = Task.State.Waiting
+        self.ret = None
+        self.let = None
+        self.stages = dict(queued=time())
+
+    def clone(self):
+        task = copy.copy(self)
+        task.reset()
+        task.tid = uuid1().int
+        task.finished = Event()
+        task.worker_address = None
+        task.attempts = 0
+        task.excluded = set()
+        task.primary = self
+        task.backup = None
+        task.cache_keys = None
+        return task
+
+    def adopt(self, task):
+        self.state, self.ret, self.worker_address = task.state, task.ret, task.worker_address
+        self.stages, self.elapsed = dict(task.stages), task.elapsed
+        self.bytes_out, self.bytes_in = task.bytes_out, task.bytes_in
 
     def dump_args(self, args, kwargs):
         args = inspect.signature(self.func).bind(*args, **kwargs)
@@ -43,59 +95,132 @@ class Task:
 
     def load_ret(self, ret):
         ret_cls = self.func.__annotations__.get("return")
-        if ret_cls:
+        if ret_cls and not isinstance(ret, (TaskFailure, ObjectRef)):
             ret = ret_cls.__load__(ret)
         return ret
 
-    def wait_for_server(self, times=TASK_WAIT_PID_RETRIES, interval=TASK_WAIT_PID_RETRY_INTERVAL):
-        try:
-            self.tid = self.port.read()
-        except OSError as e:
-            if times:
-                gevent.sleep(interval)
-                self.port.reconnect()
-                self.wait_for_server(times - 1, interval)
-            else:
-                raise e
-
-    def execute(self, worker, args, kwargs):
+    def dump_calls(self):
+        if self.calls is None:
+            self.calls = [self.dump_args(*self.args)]
+        return self.calls
+
+    def shared_objects(self):
+        args, kwargs = self.args
+        return {arg.key: arg for arg in (*args, *kwargs.values()) if isinstance(arg, SharedObject)}
+
+    def dependencies(self):
+        args, kwargs = self.args
+        return {arg for arg in (*args, *kwargs.values()) if isinstance(arg, Task)}
+
+    def inputs(self):
+        if self.input_refs is None:
+            self.input_refs = [(dep.ret.key, dep.ret.size, dep.worker_address) for dep in self.dependencies()
+                               if isinstance(dep.ret, ObjectRef)]
+            self.input_refs += [(shared.key, shared.size, None) for shared in self.shared_objects().values()]
+        return self.input_refs
+
+    def is_cacheable(self):
+        return not self.keep and not any(dep.keep for dep in self.dependencies())
+
+    def __dump__(self):
+        if isinstance(self.ret, ObjectRef):
+            return ObjectRef(self.ret.key, self.worker_address, self.ret.size)
+        return self.ret.__dump__() if hasattr(self.ret, "__dump__") else self.ret
+
+    def load_rets(self, rets):
+        return self.load_ret(rets[0])
+
+    def failures(self):
+        return [self.ret] if isinstance(self.ret, TaskFailure) else []
+
+    def execute(self, worker):
         self.state = Task.State.Ready
         worker.wait_until_idle()
-        self.state = Task.State.Running
-        self.port = ObjPort.create_connector(self.worker_address)
-        self.wait_for_server()
-        kwargs = self.dump_args(args, kwargs)
         try:
-            self.debug_stat = 1
-            self.port.write((self.func_name, kwargs))
-            self.debug_stat = 2
-            msg = self.port.read()
-            self.ret = self.load_ret(msg)
-            self.debug_stat = 3
+            if self.cancelled:
+                return
+            self.mark("acquired")
+            self.state = Task.State.Running
+            calls = self.dump_calls()
+            for shared in self.shared_objects().values():
+                worker.push_object(shared)
+            stages = self.stages
+            msg, bytes_out, bytes_in = worker.request(self.tid, self.func_name, calls, stages, self.keep)
+            if self.cancelled:
+                return
+            self.bytes_out, self.bytes_in = bytes_out, bytes_in
+            self.elapsed = stages["received"] - stages["sent"]
+            self.ret = self.load_rets(msg)
+            self.mark("finished")
             if isinstance(self.ret, TaskFailure):
                 self.state = Task.State.Failed
-                worker.on_finish_task(self)
                 self.ret.re_raise()
-            else:
-                self.state = Task.State.Succeed
-                worker.on_finish_task(self)
+            self.state = Task.State.Succeed
         except OSError as e:
-            self.state = Task.State.Failed
-            worker.on_finish_task(self)
+            if not self.cancelled:
+                self.mark("finished")
+                self.state = Task.State.Failed
             raise e
+        finally:
+            worker.on_finish_task(self)
+
+    def resolve(self, ret):
+        self.ret = ret
+        self.state = Task.State.Succeed
+        self.finished.set()
+
+    def fail(self, failure):
+        self.ret = failure
+        self.state = Task.State.Failed
+        self.finished.set()
 
     def join(self):
-        while self.state == Task.State.Waiting:
-            gevent.sleep(CLUSTER_SCHEDULE_INTERVAL)
-        self.let.join()
+        self.finished.wait()
 
     def kill(self):
         if self.let:
             self.let.kill()
-        self.clean()
 
     def __repr__(self):
         return "[T/{}]<{}>".format(self.state, self.func_name)
 
+    def is_pending(self):
+        return not self.cancelled and self.state in (Task.State.Waiting, Task.State.Ready, Task.State.Running)
+
     def is_adm_task(self):
         return self.func_name.startswith("_adm_")
+
+
+class BatchTask(Task):
+    def __init__(self, func, calls, func_name=None):
+        super(BatchTask, self).__init__(func, func_name=func_name)
+        self.args = calls
+        self.known = {}
+
+    def __len__(self):
+        return len(self.args)
+
+    def dump_all_calls(self):
+        if self.calls is None:
+            self.calls = [self.dump_args(args, kwargs) for args, kwargs in self.args]
+        return self.calls
+
+    def dump_calls(self):
+        return [kwargs for i, kwargs in enumerate(self.dump_all_calls()) if i not in self.known]
+
+    def shared_objects(self):
+        return {arg.key: arg for args, kwargs in self.args
+                for arg in (*args, *kwargs.values()) if isinstance(arg, SharedObject)}
+
+    def dependencies(self):
+        return {arg for args, kwargs in self.args for arg in (*args, *kwargs.values()) if isinstance(arg, Task)}
+
+    def fail(self, failure):
+        super(BatchTask, self).fail([failure] * len(self))
+
+    def failures(self):
+        return [ret for ret in self.ret or () if isinstance(ret, TaskFailure)]
+
+    def load_rets(self, rets):
+        rets = iter(rets)
+        return [self.known[i] if i in self.known else self.load_ret(next(rets)) for i in range(len(self))]
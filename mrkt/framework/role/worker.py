@@ -1,24 +1,49 @@
-import os.path
+from functools import lru_cache
 from logging import getLogger
-from gevent.lock import BoundedSemaphore
-
-from ...agent import DynamicAgent
-from ...common.utils import dir_delta
+from time import time
+from uuid import uuid1
+from gevent.lock import BoundedSemaphore, Semaphore
+
+from ...common.port import Channel
+from ...common.exceptions import TaskFailure
+from ...common import sync
+from ...common.consts import *
 from .task import Task
 
 logger = getLogger(__name__)
-null_agent = DynamicAgent()
+
+
+@lru_cache(maxsize=None)
+def null_agent():
+    from ...agent import DynamicAgent
+    return DynamicAgent()
 
 
 class Worker:
-    def __init__(self, agent_addr, parallel_task_limit=None):
+    def __init__(self, agent_addr, parallel_task_limit=None,
+                 compression=PORT_COMPRESSION, compression_threshold=PORT_COMPRESSION_THRESHOLD):
         self.agent_addr = agent_addr
         self.tasks = set()
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self.bytes_raw = 0
+        self.bytes_wire = 0
+        self.channels = []
+        self.connected = False
+        self.channel_lock = Semaphore()
         self.ptask_semaphore = None
         self.capacity = parallel_task_limit or self.cpu_count()
         self.ptask_semaphore = BoundedSemaphore(self.capacity)
         self.sync_tag = 0
         self.sync_flag = False
+        layers = self.synced_layers()
+        self.remote_layers = layers if isinstance(layers, list) else []
+        self.objects = set()
+        self.object_locks = {}
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_raw - self.bytes_wire
 
     def utilization(self):
         return len([t for t in self.tasks if not t.is_adm_task()]) / self.capacity
@@ -32,13 +57,64 @@ class Worker:
 
     def on_finish_task(self, task):
         self.tasks.remove(task)
-        task.clean()
+        self.bytes_raw += task.bytes_out[0] + task.bytes_in[0]
+        self.bytes_wire += task.bytes_out[1] + task.bytes_in[1]
+        logger.debug("[Worker.on_finish_task] %s: %s bytes saved by compression", task, task.bytes_saved)
         if self.ptask_semaphore is not None:
             self.ptask_semaphore.release()
 
+    def connect(self):
+        # once the agent has been up, a refused connection means it is gone, not still starting
+        retries = WORKER_RECONNECT_RETRIES if self.connected else PORT_CONNECT_RETRIES
+        channel = Channel(self.agent_addr, self.compression, self.compression_threshold, retries)
+        self.connected = True
+        self.channels.append(channel)
+        return channel
+
+    def channel(self):
+        with self.channel_lock:
+            self.channels = [c for c in self.channels if c.is_alive()]
+            if len(self.channels) < WORKER_CHANNEL_NUM and all(c.load() for c in self.channels):
+                self.connect()
+        return min(self.channels, key=Channel.load)
+
+    def probe(self):
+        with self.channel_lock:
+            self.channels = [c for c in self.channels if c.is_alive()]
+            try:
+                self.connect()
+            except OSError:
+                return False
+        return True
+
+    def request(self, rid, index, calls, stages=None, keep=None):
+        stages = {} if stages is None else stages
+        channel = self.channel()
+        stages["connected"] = time()
+        return channel.request(rid, index, calls, stages, keep)
+
+    def call(self, index, **kwargs):
+        (ret,), _, _ = self.request(uuid1().int, index, [kwargs])
+        if isinstance(ret, TaskFailure):
+            ret.re_raise()
+        return ret
+
+    def push_object(self, shared):
+        lock = self.object_locks.setdefault(shared.key, Semaphore())
+        with lock:
+            if shared.key not in self.objects:
+                self.call("_adm_store_put", key=shared.key, frame=shared.frame)
+                self.objects.add(shared.key)
+                logger.info("[Worker.push_object] %s to %s", shared, self.agent_addr[0])
+
+    def release_object(self, shared):
+        if shared.key in self.objects:
+            self.objects.discard(shared.key)
+            self.call("_adm_store_release", key=shared.key)
+
     def __getattr__(self, name):
         index = "_adm_{}".format(name)
-        func = getattr(null_agent, index)
+        func = getattr(null_agent(), index)
 
         def adm_func(*args, **kwargs):
             task = Task(func, args, kwargs, index)
@@ -51,19 +127,29 @@ class Worker:
     def __repr__(self):
         return "Client[{}]".format(self.agent_addr)
 
-    def calc_dir_delta(self, path):
-        sig = self.dir_signature(path, os.path.isdir(path))
-        logger.info("[Worker.calc_delta]: Got signature[size:%s] from %s", len(sig), self.agent_addr[0])
-        delta = dir_delta(sig, path)
-        logger.info("[Worker.calc_delta]: Delta calculated[size:%s]", len(delta))
-        return delta
-
-    def sync_with_delta(self, delta, path):
-        self.dir_patch(delta, path)
+    def is_synced(self, fingerprints):
+        return self.remote_layers[:len(fingerprints)] == fingerprints
+
+    def sync_with_manifest(self, manifest, path, source=None, ignore=(), fingerprint=None):
+        sync_id = uuid1().hex
+        if source:
+            logger.info("[Worker.sync] with %s: Pulling from %s", self.agent_addr[0], source.agent_addr[0])
+        pulled = bool(source) and self.dir_pull(sync_id, path, manifest, source.agent_addr, ignore,
+                                                self.sync_tag, fingerprint) is True
+        if not pulled:
+            remote = self.dir_manifest(path, ignore, fingerprint)
+            changed, deleted, missing = sync.diff(manifest, remote) if remote is not None else ({}, [], {})
+            logger.info("[Worker.sync] with %s: %s changed, %s deleted, %s chunks missing",
+                        self.agent_addr[0], len(changed), len(deleted), len(missing))
+            for digests in sync.batches(missing):
+                self.dir_put_chunks(sync_id, sync.read_chunks(path, manifest, digests))
+            self.dir_apply(sync_id, path, changed, deleted, ignore, self.sync_tag, fingerprint)
         logger.info("[Worker.sync] with %s: Patch finished", self.agent_addr[0])
         self.clean_cache()
         logger.info("[Worker.sync] with %s: Cache cleaned", self.agent_addr[0])
+        self.remote_layers = self.remote_layers[:self.sync_tag] + [fingerprint]
         self.sync_tag += 1
+        return pulled
 
     def is_syncing(self):
         return self.sync_flag
@@ -72,6 +158,9 @@ class Worker:
         self.sync_flag = value
 
     def clean(self):
-        for task in self.tasks:
+        for task in list(self.tasks):
             task.kill()
         self.tasks = set()
+        for channel in self.channels:
+            channel.close()
+        self.channels = []
@@ -2,7 +2,10 @@ import os
 import os.path
 import paramiko
 import json
+import tarfile
+from functools import lru_cache
 from gevent import sleep
+from gevent.lock import Semaphore
 from logging import getLogger
 
 from ..role import Service
@@ -11,15 +14,30 @@ from ...common.consts import *
 
 logger = getLogger(__name__)
 
-CMD_AGENT_START = "mrkt-agent -p {in_port} -l info ."
-CMD_DOCKER_START_CONTAINER = "docker run -itd --name {name} -p {out_port}:{in_port} {image} {engine_start_cmd}"
+CMD_AGENT_START = "mrkt-agent -p {in_port} -l info {options} ."
+CMD_DOCKER_START_CONTAINER = "docker run -itd --name {name} {label}{cpuset}-p {out_port}:{in_port} {image} {engine_start_cmd}"
 CMD_DOCKER_RM_CONTAINER = "docker rm -f {name}"
-CMD_DOCKER_INSTALL_IMAGE = "gunzip -c {image} | docker load && rm {image}"
+CMD_DOCKER_INSTALL_IMAGE = "gunzip -c | docker load"
+CMD_DOCKER_IMAGE_ID = "docker images -q --no-trunc {image}"
+CMD_PRIVATE_ADDRESS = "hostname -I"
+CMD_DOCKER_SEED_IMAGE = "nohup ncat -lk {address} {port} --send-only --sh-exec 'docker save {image}' >/dev/null 2>&1 & echo $!"
+CMD_DOCKER_FETCH_IMAGE = "ncat --recv-only {peer} {port} | docker load"
+CMD_KILL = "kill {pid}"
 CMD_DOCKER_UPDATE_IMAGE = "docker pull {image}"
 CMD_DOCKER_UNINSTALLL_IMAGE = "docker rmi {image}"
 CMD_DOCKER_LS_CONTAINERS = "docker container ls -a --format \"{{json .Names}}\""
+CMD_DOCKER_LS_RUNNING = "docker ps --format '{{.Names}} {{.Label \"mrkt.config\"}}'"
 CMD_DOCKER_LS_IMAGES = "docker images --format \"{{json .Repository}}\""
 CMD_DOCKER_LIST_NONE_IMAGES = "docker images | grep '<none>' | awk '{print $3}'"
+CMD_LS_CPUS = "lscpu -p=CPU,NODE"
+
+
+@lru_cache()
+def read_archive_image_id(archive, mtime):
+    with tarfile.open(archive, "r:*") as tar:
+        manifest = json.load(tar.extractfile("manifest.json"))
+    config = manifest[0]["Config"]
+    return "sha256:" + os.path.basename(config).split(".")[0]
 
 
 class ViaSSH(Service):
@@ -29,6 +47,9 @@ class ViaSSH(Service):
         self.ssh_options = ssh_options
         self.retry_ssh = SERVICE_SSH_RETRY_TIMES
         self.retry_ssh_interval = SERVICE_SSH_RETRY_INTERVAL
+        self.image_seed_port = SERVICE_IMAGE_SEED_PORT
+        self.image_seeds = {}
+        self.image_seed_lock = Semaphore()
 
     def set_options(self, *options_list):
         ssh_options = self.ssh_options
@@ -66,17 +87,59 @@ class ViaSSH(Service):
             for line in self.cmd(CMD_DOCKER_LS_IMAGES).splitlines():
                 yield json.loads(line)
 
-    def install_image_via_archive(self, archive):
-        file_name = os.path.basename(archive)
-        sftp = paramiko.SFTPClient.from_transport(
-            self.ssh_client.get_transport())
-        sftp.put(archive, os.path.join("", file_name))
-        out = self.cmd(
-            CMD_DOCKER_INSTALL_IMAGE.format(image=file_name))
-        for line in out.splitlines():
+    def image_id(self, image_name):
+        out = self.cmd(CMD_DOCKER_IMAGE_ID.format(image=image_name))
+        return out.split()[0] if out and out.strip() else None
+
+    def archive_image_id(self, archive):
+        try:
+            return read_archive_image_id(archive, os.path.getmtime(archive))
+        except (OSError, KeyError, ValueError, tarfile.TarError):
+            return None
+
+    @staticmethod
+    def loaded_image(out):
+        for line in (out or "").splitlines():
             if line.startswith("Loaded image:"):
                 return line[13:].strip()
 
+    def install_image_via_archive(self, archive):
+        with open(archive, "rb") as f:
+            out = self.cmd(CMD_DOCKER_INSTALL_IMAGE, stdin=f)
+        return self.loaded_image(out)
+
+    def private_address(self):
+        out = self.cmd(CMD_PRIVATE_ADDRESS)
+        return out.split()[0] if out and out.strip() else None
+
+    def seed_image(self, image_name):
+        with self.image_seed_lock:
+            if image_name not in self.image_seeds:
+                address = self.private_address()
+                if address is None:
+                    return None
+                port = self.image_seed_port + len(self.image_seeds)
+                pid = self.cmd(CMD_DOCKER_SEED_IMAGE.format(address=address, port=port, image=image_name))
+                if not pid:
+                    return None
+                self.image_seeds[image_name] = (address, port, pid.strip())
+            return self.image_seeds[image_name][:2]
+
+    def stop_seeding(self):
+        for _, _, pid in self.image_seeds.values():
+            self.cmd(CMD_KILL.format(pid=pid))
+        self.image_seeds = {}
+
+    def install_image_from_peer(self, peer, image_name):
+        peer_id = peer.image_id(image_name)
+        if peer_id and peer_id == self.image_id(image_name):
+            return image_name
+        seed = peer.seed_image(image_name)
+        if seed is None:
+            return None
+        address, port = seed
+        return self.loaded_image(self.cmd(CMD_DOCKER_FETCH_IMAGE.format(peer=address, port=port)))
+
     def install_image_via_name(self, image_name):
         self.cmd(CMD_DOCKER_UPDATE_IMAGE.format(image=image_name))
         return image_name
@@ -91,11 +154,32 @@ class ViaSSH(Service):
         for line in self.cmd(CMD_DOCKER_LS_CONTAINERS).splitlines():
             yield json.loads(line)
 
-    def start_containers(self, out_port):
-        name = "{}_{}".format(SERVICE_CONTAINER_PREFIX, out_port)
-        engine_start_cmd = CMD_AGENT_START.format(in_port=AGENT_PORT)
+    def cpu_topology(self):
+        topology = []
+        for line in (self.cmd(CMD_LS_CPUS) or "").splitlines():
+            if line and not line.startswith("#"):
+                cpu, node = line.split(",")[:2]
+                topology.append((int(cpu), int(node or 0)))
+        return topology
+
+    def running_containers(self):
+        running = {}
+        for line in (self.cmd(CMD_DOCKER_LS_RUNNING) or "").splitlines():
+            name, _, config = line.strip().partition(" ")
+            running[name] = config.strip()
+        return running
+
+    def start_containers(self, out_port, cpus=None, mems=None, config=None):
+        name = self.container_name(out_port)
+        label = "--label mrkt.config={} ".format(config) if config else ""
+        engine_start_cmd = CMD_AGENT_START.format(in_port=AGENT_PORT, options=self.agent_options())
+        cpuset = ""
+        if cpus:
+            cpuset += "--cpuset-cpus {} ".format(",".join(map(str, cpus)))
+        if mems is not None:
+            cpuset += "--cpuset-mems {} ".format(mems)
         docker_start_cmd = CMD_DOCKER_START_CONTAINER.format(
-            name=name, image=self.image, engine_start_cmd=engine_start_cmd,
+            name=name, image=self.image, engine_start_cmd=engine_start_cmd, label=label, cpuset=cpuset,
             in_port=AGENT_PORT, out_port=out_port)
         return name if self.cmd(docker_start_cmd) else None
 
@@ -111,14 +195,19 @@ class ViaSSH(Service):
     def clean(self):
         super(ViaSSH, self).clean()
         if self.ssh_client:
+            self.stop_seeding()
             self.ssh_client.close()
             self.ssh_client = None
 
-    def cmd(self, cmd):
+    def cmd(self, cmd, stdin=None):
         logger.info("[%s.cmd] on %s: %s",
                     self.__class__.__name__,
                     self.address, cmd)
-        _, out, err = self.ssh_client.exec_command(cmd)
+        inp, out, err = self.ssh_client.exec_command(cmd)
+        if stdin:
+            for block in iter(lambda: stdin.read(SERVICE_IMAGE_STREAM_BLOCK), b""):
+                inp.write(block)
+            inp.channel.shutdown_write()
         if out.channel.recv_exit_status() != 0:
             logger.critical("[%s.cmd] on %s: %s",
                             self.__class__.__name__,
@@ -0,0 +1,83 @@
+import glob
+import os
+import os.path
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from logging import getLogger
+
+import mrkt
+from ..role import Service
+from ...common.consts import *
+
+logger = getLogger(__name__)
+
+CMD_AGENT_START = "from mrkt.agent import DynamicAgent; DynamicAgent.launch()"
+
+
+class LocalProcess(Service):
+    def __init__(self, address="127.0.0.1", python=sys.executable):
+        super(LocalProcess, self).__init__(address)
+        self.python = python
+        self.image = None
+        self.root = None
+        self.processes = {}
+
+    def connect(self):
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="mrkt_local_")
+
+    def install_image(self):
+        pass
+
+    def existing_images(self, only_outdated=False):
+        return []
+
+    def uninstall_images(self, images):
+        pass
+
+    def image_id(self, image_name):
+        return None
+
+    def existing_containers(self):
+        return [name for name, (proc, _) in self.processes.items() if proc.poll() is None]
+
+    def running_containers(self):
+        return {name: config for name, (proc, config) in self.processes.items() if proc.poll() is None}
+
+    def cpu_topology(self):
+        nodes = {}
+        for node_dir in glob.glob("/sys/devices/system/node/node[0-9]*"):
+            node = int(os.path.basename(node_dir)[4:])
+            for cpu_dir in glob.glob(os.path.join(node_dir, "cpu[0-9]*")):
+                nodes[int(os.path.basename(cpu_dir)[3:])] = node
+        return [(cpu, nodes.get(cpu, 0)) for cpu in sorted(os.sched_getaffinity(0))]
+
+    def start_containers(self, out_port, cpus=None, mems=None, config=None):
+        name = self.container_name(out_port)
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        cmd = [self.python, "-c", CMD_AGENT_START, path, "-p", str(out_port)] + shlex.split(self.agent_options())
+        python_path = [os.path.dirname(os.path.dirname(os.path.abspath(mrkt.__file__)))]
+        if os.environ.get("PYTHONPATH"):
+            python_path.append(os.environ["PYTHONPATH"])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+        preexec_fn = (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+        self.processes[name] = subprocess.Popen(cmd, cwd=path, env=env, preexec_fn=preexec_fn), config
+        logger.info("[LocalProcess.start_containers] %s on port %s", name, out_port)
+        return name
+
+    def kill_containers(self, dockers=None):
+        for name in dockers or self.containers:
+            proc, _ = self.processes.pop(name, (None, None))
+            if proc and proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+
+    def clean(self):
+        super(LocalProcess, self).clean()
+        if self.root and not self.keep_warm:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
@@ -12,4 +12,5 @@ setup(name="mrkt",
       },
       entry_points=dict(
           console_scripts=["mrkt-agent=mrkt.agent:DynamicAgent.launch",
+                           "mrkt-scheduler=mrkt.framework.cluster.scheduler:Scheduler.launch",
                            "mrkt-pack=mrkt.tools:pack_docker"]))
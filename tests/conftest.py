@@ -0,0 +1,30 @@
+import os.path
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mrkt.common import patch
+
+patch()
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def loopback(monkeypatch):
+    from mrkt.framework import Pool, Hosts, LocalProcess
+    monkeypatch.chdir(TESTS_DIR)
+    pools = []
+
+    def make(agents=2, port=18600, **options):
+        service = LocalProcess()
+        pool = Pool([Hosts(service)], containers_per_host=agents, worker_port=port, cpu_pinning=None, **options)
+        pool.service = service
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.clean()
@@ -0,0 +1,96 @@
+from itertools import count
+from time import time
+from types import SimpleNamespace
+
+from mrkt.framework.platform.AWS import EC2
+
+
+class FakeVM:
+    ids = count()
+
+    def __init__(self, ec2, vm_type, spot=False, boot_time=0):
+        self.ec2 = ec2
+        self.id = "i-{}".format(next(self.ids))
+        self.instance_type = vm_type
+        self.instance_lifecycle = "spot" if spot else None
+        self.meta = SimpleNamespace(data=None)
+        self.calls = []
+        self.boot(boot_time)
+
+    def boot(self, boot_time=0):
+        self.state = {"Name": "pending"}
+        self.ready_at = time() + boot_time
+
+    def refresh(self):
+        if self.state["Name"] == "pending" and time() >= self.ready_at:
+            self.state = {"Name": "running"}
+
+    def load(self):
+        self.ec2.describes += 1
+        self.refresh()
+
+    def start(self):
+        self.calls.append("start")
+        self.boot()
+
+    def stop(self):
+        self.calls.append("stop")
+        self.state = {"Name": "stopped"}
+
+    def terminate(self):
+        self.calls.append("terminate")
+        self.state = {"Name": "terminated"}
+
+
+class FakeEC2:
+    def __init__(self, boot_time=0):
+        self.boot_time = boot_time
+        self.vms = []
+        self.launches = []
+        self.describes = 0
+        self.instances = self
+
+    def filter(self, Filters=None, InstanceIds=None):
+        self.describes += 1
+        if InstanceIds is not None:
+            for vm in self.vms:
+                vm.refresh()
+            return [vm for vm in self.vms if vm.id in InstanceIds]
+        filters = {f["Name"]: f["Values"] for f in Filters}
+        return [vm for vm in self.vms if vm.instance_type in filters["instance-type"]
+                and vm.state["Name"] in filters["instance-state-name"]]
+
+    def create_instances(self, **request):
+        self.launches.append(request)
+        vms = [FakeVM(self, request["InstanceType"], "InstanceMarketOptions" in request, self.boot_time)
+               for _ in range(request["MinCount"])]
+        self.vms.extend(vms)
+        return vms
+
+
+class FakeService:
+    def __init__(self, vm):
+        self.vm = vm
+        self.workers = []
+        self.worker_listener = None
+
+    def set_options(self, *options_list):
+        for options in options_list:
+            self.worker_listener = options.get("worker_listener", self.worker_listener)
+
+    def prepare_workers(self):
+        self.workers = [SimpleNamespace(tasks=set(), capacity=1, agent_addr=(self.vm.id, 0))]
+        if self.worker_listener:
+            self.worker_listener(self.workers)
+
+    def clean(self):
+        self.workers = []
+
+
+class FakeEC2Platform(EC2):
+    def __init__(self, requests=None, ec2_resource=None, **options):
+        super(FakeEC2Platform, self).__init__(requests or {}, "sg-fake", "key", "key.pem", ami="ami-fake",
+                                              ec2_resource=ec2_resource or FakeEC2(), **options)
+
+    def service_on_VM(self, vm):
+        return FakeService(vm)
@@ -0,0 +1,15 @@
+import os.path
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.mark.parametrize("options", [[], ["--prefork", "1"], ["--prefork", "2"]])
+def test_idle_agent_exits(tmp_path, options):
+    cmd = [sys.executable, "-c", "from mrkt.agent import DynamicAgent; DynamicAgent.launch()",
+           str(tmp_path), "-p", "18700", "--idle-timeout", "1"] + options
+    proc = subprocess.run(cmd, cwd=str(tmp_path), env=dict(os.environ, PYTHONPATH=ROOT), timeout=30)
+    assert proc.returncode == 0
@@ -0,0 +1,94 @@
+import gevent
+
+from mrkt.framework.cluster.autoscale import Autoscaler
+
+from fake_ec2 import FakeEC2Platform
+
+
+class FakePool:
+    def __init__(self, platform):
+        self.platform = platform
+        self.backlog = 0
+        self.completed = 0
+        self.processing_tasks = set()
+        self.autoscalers = []
+
+    def queued(self):
+        return self.backlog
+
+    @property
+    def capacity(self):
+        return sum(worker.capacity for service in self.platform.services for worker in service.workers)
+
+
+def make_autoscaler(**options):
+    platform = FakeEC2Platform()
+    platform.prepare_services({})
+    pool = FakePool(platform)
+    scaler = Autoscaler(pool, platform, "c4.large", target=1, interval=10, **options)
+    scaler.let.kill()
+    return scaler, pool, platform
+
+
+def step(scaler):
+    with gevent.Timeout(10):
+        while not all(map(scaler.ready, scaler.VMs)):
+            gevent.sleep(0.05)
+    scaler.observe()
+    scaler.scale()
+
+
+def test_scales_up_while_tasks_outlast_the_interval():
+    scaler, pool, platform = make_autoscaler(max_vms=3)
+    pool.backlog = 100
+    step(scaler)
+    assert len(platform.VMs) == 1
+    # the first VM is busy, but none of its tasks has finished yet
+    pool.processing_tasks = {"task"}
+    step(scaler)
+    assert len(platform.VMs) == 3
+    assert len(platform.ec2_client.launches) == 2
+    step(scaler)
+    assert len(platform.VMs) == 3
+
+
+def test_scales_down_idle_vms_to_the_minimum():
+    scaler, pool, platform = make_autoscaler(min_vms=1, max_vms=3, idle_timeout=0)
+    pool.backlog = 100
+    step(scaler)
+    pool.processing_tasks = {"task"}
+    step(scaler)
+    assert len(platform.VMs) == 3
+    pool.backlog, pool.completed, pool.processing_tasks = 0, 100, set()
+    gevent.sleep(0.01)
+    step(scaler)
+    assert len(platform.VMs) == 1 and scaler.VMs == platform.VMs
+    stopped = [vm for vm in platform.ec2_client.vms if vm.calls == ["stop"]]
+    assert len(stopped) == 2 and all(vm not in platform.vm_services for vm in stopped)
+
+
+def test_restarts_stopped_vms_before_launching():
+    scaler, pool, platform = make_autoscaler(max_vms=1, idle_timeout=0)
+    pool.backlog = 10
+    step(scaler)
+    pool.backlog = 0
+    gevent.sleep(0.01)
+    step(scaler)
+    assert not platform.VMs
+    pool.backlog = 10
+    step(scaler)
+    assert len(platform.ec2_client.launches) == 1
+    assert platform.ec2_client.vms[0].calls == ["stop", "start"]
+
+
+def test_pool_clean_stops_its_autoscalers():
+    from mrkt.framework import Pool
+    platform = FakeEC2Platform()
+    pool = Pool([platform], sync_current_dir=False)
+    scaler = Autoscaler(pool, platform, "c4.large", interval=0.05)
+    launched = []
+    platform.scale_up = lambda *args: launched.append(args) or []
+    pool.submit(sum, [1, 2])
+    pool.clean()
+    gevent.sleep(0.3)
+    assert not launched and scaler.let.dead
@@ -0,0 +1,59 @@
+import os
+
+from mrkt.framework.cluster.cache import ResultCache
+from mrkt.common.consts import POOL_CACHE_DISK_LOW_WATER
+
+
+def square(x):
+    return x * x
+
+
+def count_dispatches(pool, monkeypatch):
+    dispatched = []
+    dispatch = pool.dispatch
+    monkeypatch.setattr(pool, "dispatch", lambda task, worker: dispatched.append(task) or dispatch(task, worker))
+    return dispatched
+
+
+def test_overwriting_a_key_keeps_disk_usage(tmp_path):
+    cache = ResultCache(path=str(tmp_path))
+    cache.put("key", b"x" * 1000)
+    usage = cache.disk_usage
+    cache.put("key", b"x" * 1000)
+    assert cache.disk_usage == usage == sum(os.path.getsize(f) for f in cache.disk_files())
+
+
+def test_disk_is_evicted_oldest_first_to_the_low_water_mark(tmp_path):
+    cache = ResultCache(capacity=1, path=str(tmp_path), disk_limit=10 ** 9)
+    for i in range(10):
+        cache.put(str(i), bytes(1000))
+        os.utime(cache.disk_file(str(i)), (i, i))
+    size = os.path.getsize(cache.disk_file("0"))
+    cache.disk_limit = 9 * size
+    cache.put("10", bytes(1000))
+    assert cache.disk_usage == sum(os.path.getsize(f) for f in cache.disk_files())
+    assert cache.disk_usage <= cache.disk_limit * POOL_CACHE_DISK_LOW_WATER
+    assert not os.path.exists(cache.disk_file("0")) and os.path.exists(cache.disk_file("10"))
+    assert ResultCache(path=str(tmp_path)).get("9") == (True, bytes(1000))
+
+
+def test_cached_results_are_served_without_a_worker(loopback, tmp_path, monkeypatch):
+    pool = loopback(agents=1, port=18660, cache=ResultCache(path=str(tmp_path)))
+    assert list(pool.map(square, range(4))) == [0, 1, 4, 9]
+    dispatched = count_dispatches(pool, monkeypatch)
+    task = pool.submit(square, 3)
+    assert task.finished.is_set() and task.ret == 9 and task.worker_address is None
+    assert list(pool.map(square, range(4))) == [0, 1, 4, 9]
+    assert not dispatched
+
+
+def test_changed_code_invalidates_cached_results(loopback, tmp_path, monkeypatch):
+    pool = loopback(agents=1, port=18670, cache=ResultCache(path=str(tmp_path / "cache")))
+    pool.submit(square, 3).join()
+    dispatched = count_dispatches(pool, monkeypatch)
+    (tmp_path / "extra").mkdir()
+    (tmp_path / "extra" / "module.py").write_text("VALUE = 1\n")
+    pool.sync_dir(str(tmp_path / "extra"))
+    task = pool.submit(square, 3)
+    task.join()
+    assert task.ret == 9 and dispatched == [task]
@@ -0,0 +1,29 @@
+from time import time
+
+import gevent
+
+from mrkt.common.consts import PLATFORM_PAAS_VM_WAIT_INTERVAL
+
+from fake_ec2 import FakeEC2Platform
+
+
+def test_fleet_is_polled_in_batches_and_served_as_it_boots():
+    platform = FakeEC2Platform({"c4.large": 50})
+    ec2 = platform.ec2_client
+    announced = []
+    start = time()
+    platform.prepare_services(dict(worker_listener=lambda workers: announced.append(time() - start)))
+    assert len(ec2.vms) == 50
+    # boots spread over 2.5s, the first one already up
+    for i, vm in enumerate(ec2.vms):
+        vm.ready_at = start + i * 0.05
+    with gevent.Timeout(10):
+        while len(platform.services) < 1:
+            gevent.sleep(0.01)
+        first = time() - start
+        platform.pending_lets.join()
+    assert len(platform.services) == 50 and len(announced) == 50
+    assert first < PLATFORM_PAAS_VM_WAIT_INTERVAL
+    rounds = 2.5 / PLATFORM_PAAS_VM_WAIT_INTERVAL + 2
+    # one describe to find existing VMs, then one per polling round rather than one per VM
+    assert ec2.describes <= 1 + rounds
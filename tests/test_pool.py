@@ -0,0 +1,180 @@
+from time import time, sleep
+
+import gevent
+import pytest
+
+
+def square(x):
+    return x * x
+
+
+def kill_agent(pool, port):
+    proc, _ = pool.service.processes[pool.service.container_name(port)]
+    proc.kill()
+    proc.wait()
+
+
+def test_dead_agent_does_not_stall_later_maps(loopback):
+    pool = loopback(agents=2, port=18610)
+    assert list(pool.map(square, range(6))) == [x * x for x in range(6)]
+    kill_agent(pool, 18611)
+    for _ in range(3):
+        start = time()
+        assert list(pool.map(square, range(6))) == [x * x for x in range(6)]
+        assert time() - start < 5
+    assert ("127.0.0.1", 18611) in pool.unhealthy
+
+
+def test_recovered_agent_is_scheduled_again(loopback):
+    pool = loopback(agents=2, port=18620)
+    list(pool.map(square, range(4)))
+    kill_agent(pool, 18621)
+    list(pool.map(square, range(4)))
+    assert ("127.0.0.1", 18621) in pool.unhealthy
+    pool.service.start_containers(18621)
+    deadline = time() + 20
+    while ("127.0.0.1", 18621) in pool.unhealthy and time() < deadline:
+        gevent.sleep(0.2)
+    assert ("127.0.0.1", 18621) not in pool.unhealthy
+    tasks = [pool.submit(sleep, 0.2) for _ in range(2 * pool.capacity)]
+    for task in tasks:
+        task.join()
+    assert {task.worker_address[1] for task in tasks} == {18620, 18621}
+
+
+def make_list(n):
+    return list(range(n))
+
+
+def total(values):
+    return sum(values)
+
+
+def consume_elsewhere(pool, dep):
+    from mrkt.framework.role import Task
+    dep.join()
+    task = Task(total, [dep])
+    task.excluded.add(dep.worker_address)
+    return pool.start(task)
+
+
+def test_deferred_result_consumed_on_another_agent(loopback):
+    pool = loopback(agents=2, port=18630)
+    dep = pool.defer(make_list, 1000)
+    task = consume_elsewhere(pool, dep)
+    task.join()
+    assert task.ret == sum(range(1000))
+    assert task.worker_address != dep.worker_address
+    assert not task.relayed
+
+
+def test_unreachable_deferred_result_is_relayed(loopback, monkeypatch):
+    from mrkt.common.store import ObjectRef
+    from mrkt.framework.role import Task
+    pool = loopback(agents=2, port=18640)
+    dep = pool.defer(make_list, 1000)
+    # advertise an address the agents cannot reach, as a container would see the client's "localhost"
+    monkeypatch.setattr(Task, "__dump__", lambda self: ObjectRef(self.ret.key, ("127.0.0.1", 1), self.ret.size))
+    task = consume_elsewhere(pool, dep)
+    task.join()
+    assert task.ret == sum(range(1000))
+    assert task.worker_address != dep.worker_address
+    assert task.relayed
+
+
+def size(data):
+    return len(data)
+
+
+def test_stats_show_bytes_saved_by_compression(loopback):
+    pool = loopback(agents=1, port=18650)
+    assert list(pool.map(size, [b"x" * (1 << 20)] * 2)) == [1 << 20] * 2
+    stats = pool.stats()["function"]["test_pool:size"]
+    assert stats["bytes"]["out_raw"]["sum"] > 2 << 20 > stats["bytes"]["out"]["sum"]
+    assert stats["bytes_saved"] > 0
+    assert 'mrkt_task_bytes_saved{function="test_pool:size"}' in pool.export_stats()
+
+
+def test_consumer_waits_for_the_worker_holding_its_input(loopback):
+    from mrkt.framework.role import Task
+    pool = loopback(agents=2, port=18680, locality_wait=1)
+    dep = pool.defer(make_list, 1000)
+    dep.join()
+    for _ in range(3):
+        task = pool.start(Task(total, [dep]))
+        task.join()
+        assert task.worker_address == dep.worker_address
+    holder = pool.worker_at(dep.worker_address)
+    blockers = []
+    for _ in range(holder.capacity):
+        blocker = Task(sleep, [3])
+        blocker.excluded = {worker.agent_addr for worker in pool.workers if worker is not holder}
+        blockers.append(pool.start(blocker))
+    gevent.sleep(0.5)
+    task = pool.start(Task(total, [dep]))
+    task.join()
+    assert task.ret == sum(range(1000)) and task.worker_address != dep.worker_address
+    assert 1 <= task.stages["assigned"] - task.stages["queued"] < 2.5
+    for blocker in blockers:
+        blocker.join()
+
+
+@pytest.mark.parametrize("method", ["imap", "imap_unordered"])
+def test_lazy_submission_is_bounded_by_pending_limit(loopback, method):
+    from mrkt.common.consts import POOL_PENDING_FACTOR
+    pool = loopback(agents=1, port=18690)
+    while not pool.capacity:
+        gevent.sleep(0.1)
+    pulled = 0
+
+    def numbers():
+        nonlocal pulled
+        for i in range(50):
+            pulled += 1
+            yield i
+
+    limit = POOL_PENDING_FACTOR * pool.capacity
+    results = []
+    for result in getattr(pool, method)(square, numbers()):
+        results.append(result)
+        assert pulled <= len(results) + limit
+    assert sorted(results) == [x * x for x in range(50)]
+
+
+def nap(seconds):
+    sleep(seconds)
+    return seconds
+
+
+def fail_on(x, bad):
+    if x == bad:
+        raise ValueError(x)
+    return x
+
+
+def test_imap_keeps_input_order(loopback):
+    pool = loopback(agents=2, port=18700)
+    delays = [0.4, 0.1, 0.3, 0.0, 0.2]
+    assert list(pool.imap(nap, delays)) == delays
+    assert list(pool.imap(square, range(20), chunksize=3)) == [x * x for x in range(20)]
+
+
+def test_imap_unordered_and_as_completed_follow_completion(loopback):
+    pool = loopback(agents=2, port=18710)
+    while pool.capacity < 2:
+        gevent.sleep(0.1)
+    assert list(pool.imap_unordered(nap, [0.6, 0.0])) == [0.0, 0.6]
+    tasks = [pool.submit(nap, seconds) for seconds in (0.6, 0.0)]
+    assert [task.ret for task in pool.as_completed(tasks)] == [0.0, 0.6]
+
+
+def test_failures_are_returned_in_place(loopback):
+    from mrkt.common.exceptions import TaskFailure
+    pool = loopback(agents=1, port=18720)
+    for method in ("imap", "imap_unordered"):
+        results = list(getattr(pool, method)(fail_on, range(6), [3] * 6, chunksize=2))
+        failures = [r for r in results if isinstance(r, TaskFailure)]
+        assert len(failures) == 1 and isinstance(failures[0].exception, ValueError)
+        assert sorted(r for r in results if not isinstance(r, TaskFailure)) == [0, 1, 2, 4, 5]
+    task = pool.submit(fail_on, 1, 1)
+    assert [each.state for each in pool.as_completed([task])] == [task.State.Failed]
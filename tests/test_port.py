@@ -0,0 +1,83 @@
+import gevent
+import gevent.socket
+import pytest
+
+from mrkt.common.port import ObjPort, CODECS, SERIALIZER_PICKLE, SERIALIZER_DILL, loads, safe_send
+from mrkt.common.consts import PORT_SEND_MAX_PARTS
+
+
+@pytest.fixture
+def ports():
+    a, b = gevent.socket.socketpair()
+    writer, reader = ObjPort(a), ObjPort(b)
+    yield writer, reader
+    writer.close()
+    reader.close()
+
+
+def roundtrip(ports, obj):
+    writer, reader = ports
+    sending = gevent.spawn(writer.write, obj)
+    frame = reader.read_frame()
+    sent = sending.get(timeout=10)
+    assert frame.wire_size == sent.wire_size
+    return loads(frame), frame
+
+
+def test_bytes(ports):
+    data = bytes(range(256)) * 1000
+    obj, frame = roundtrip(ports, data)
+    assert obj == data and frame.serializer == SERIALIZER_PICKLE
+
+
+def test_numpy_arrays(ports):
+    numpy = pytest.importorskip("numpy")
+    contiguous = numpy.arange(100000, dtype=numpy.float64).reshape(1000, 100)
+    strided = contiguous[::3, ::7]
+    (a, b), frame = roundtrip(ports, (contiguous, strided))
+    assert len(frame.parts) > 1
+    assert (a == contiguous).all() and (b == strided).all() and b.shape == strided.shape
+
+
+def test_main_functions_are_sent_by_value(ports):
+    namespace = {"__name__": "__main__"}
+    exec("def double(x):\n    return 2 * x\n", namespace)
+    func, frame = roundtrip(ports, namespace["double"])
+    assert frame.serializer == SERIALIZER_DILL
+    assert func(21) == 42
+
+
+def test_more_buffers_than_one_sendmsg(ports):
+    numpy = pytest.importorskip("numpy")
+    arrays = [numpy.full(100 + i, i, dtype=numpy.int32) for i in range(2 * PORT_SEND_MAX_PARTS + 3)]
+    objs, frame = roundtrip(ports, arrays)
+    assert len(frame.parts) > PORT_SEND_MAX_PARTS
+    assert all((a == b).all() for a, b in zip(objs, arrays))
+
+
+def test_safe_send_handles_partial_sends():
+    a, b = gevent.socket.socketpair()
+    bufs = [bytes([i % 256]) * (1000 + i) for i in range(PORT_SEND_MAX_PARTS + 100)]
+    expected = b"".join(bufs)
+    received = bytearray()
+
+    def read():
+        while len(received) < len(expected):
+            received.extend(b.recv(1 << 16))
+
+    reading = gevent.spawn(read)
+    assert safe_send(a, bufs + [b""])
+    reading.get(timeout=10)
+    assert received == expected
+    a.close()
+    b.close()
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+@pytest.mark.parametrize("size, compressed", [(1000, False), (200000, True)])
+def test_codecs_respect_threshold(ports, codec, size, compressed):
+    ports[0].set_compression(codec, 64 * 1024)
+    data = b"mrkt" * (size // 4)
+    obj, frame = roundtrip(ports, data)
+    assert obj == data
+    assert (frame.wire_size < size) == compressed
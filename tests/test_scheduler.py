@@ -0,0 +1,83 @@
+from time import sleep, time
+
+import gevent
+import pytest
+
+from conftest import TESTS_DIR
+
+
+def stamp(seconds):
+    sleep(seconds)
+    return time()
+
+
+def square(x):
+    return x * x
+
+
+def head(values):
+    return values[:3]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    from mrkt.framework import Hosts, LocalProcess
+    from mrkt.framework.cluster.scheduler import Scheduler, RemotePool
+    monkeypatch.chdir(TESTS_DIR)
+    clients = []
+
+    def make(port, agents=1):
+        scheduler = Scheduler([Hosts(LocalProcess())], containers_per_host=agents, worker_port=port + 1,
+                              cpu_pinning=None)
+        server = gevent.spawn(scheduler.run, port=port)
+        clients.append((scheduler, server))
+        with gevent.Timeout(30):
+            while scheduler.pool.capacity < agents:
+                gevent.sleep(0.1)
+        return scheduler, lambda: clients.append(RemotePool(("127.0.0.1", port))) or clients[-1]
+
+    yield make
+    for client in reversed(clients):
+        if isinstance(client, tuple):
+            scheduler, server = client
+            server.kill()
+            scheduler.pool.clean()
+        else:
+            client.clean()
+
+
+def test_remote_pool_map_and_put(scheduler):
+    _, connect = scheduler(18900)
+    pool = connect()
+    assert list(pool.map(square, range(10))) == [x * x for x in range(10)]
+    shared = pool.put(list(range(100)))
+    assert pool.submit(head, shared).join() is None
+    assert [pool.fetch(pool.submit(head, shared)) for _ in range(2)] == [[0, 1, 2]] * 2
+
+
+def test_jobs_are_interleaved_fairly(scheduler):
+    server, connect = scheduler(18910)
+    first, second = connect(), connect()
+    early = [first.submit(stamp, 0.05) for _ in range(10)]
+    gevent.sleep(0.02)
+    late = [second.submit(stamp, 0.05) for _ in range(10)]
+    finished = sorted([(first.fetch(task), "first") for task in early] +
+                      [(second.fetch(task), "second") for task in late])
+    jobs = [job for _, job in finished]
+    # first come, first served would finish every task of the first job before the second one starts
+    assert "second" in jobs[:10] and "first" in jobs[10:]
+    assert set(server.pool.running.values()) <= {0}
+
+
+def test_suspend_holds_a_running_task_on_a_busy_worker(scheduler):
+    server, connect = scheduler(18920)
+    pool = connect()
+    task, *others = [pool.submit(stamp, 1) for _ in range(server.pool.capacity)]
+    gevent.sleep(0.5)
+    assert pool.worker.call("_adm_suspend", uuid=task.tid)
+    gevent.sleep(1.5)
+    assert task.is_pending()
+    assert pool.worker.call("_adm_resume", uuid=task.tid)
+    for each in [task, *others]:
+        each.join()
+    assert task.state == task.State.Succeed
@@ -0,0 +1,27 @@
+from mrkt.framework.role.service import Service
+
+# two NUMA nodes with interleaved numbering, as lscpu reports on many dual-socket hosts
+TOPOLOGY = [(cpu, cpu % 2) for cpu in range(8)]
+
+
+def test_plain_split_keeps_nodes_together():
+    assert Service.split_cpus(TOPOLOGY, 2) == [([0, 2, 4, 6], None), ([1, 3, 5, 7], None)]
+    assert Service.split_cpus(TOPOLOGY, 3) == [([0, 2], None), ([4, 6, 1], None), ([3, 5, 7], None)]
+
+
+def test_numa_split_aligns_containers_with_nodes():
+    assert Service.split_cpus(TOPOLOGY, 2, numa=True) == [([0, 2, 4, 6], 0), ([1, 3, 5, 7], 1)]
+    assert Service.split_cpus(TOPOLOGY, 3, numa=True) == [([0, 2], 0), ([1, 3, 5, 7], 1), ([4, 6], 0)]
+    for cpus, node in Service.split_cpus(TOPOLOGY, 5, numa=True):
+        assert cpus and all(cpu % 2 == node for cpu in cpus)
+
+
+def test_more_containers_than_cores_share_cores():
+    cpu_sets = Service.split_cpus([(0, 0), (1, 0)], 5)
+    assert [cpus for cpus, _ in cpu_sets] == [[0], [0], [0], [1], [1]]
+    cpu_sets = Service.split_cpus([(0, 0), (1, 1)], 4, numa=True)
+    assert cpu_sets == [([0], 0), ([1], 1), ([0], 0), ([1], 1)]
+
+
+def test_unknown_topology_is_not_pinned():
+    assert Service.split_cpus([], 3, numa=True) == [(None, None)] * 3
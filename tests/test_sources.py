@@ -0,0 +1,33 @@
+import gevent
+
+from mrkt.framework.role.cluster import SourcePool
+
+
+def test_client_serves_before_peers():
+    sources = SourcePool(fanout=1)
+    sources.release("layer", None, "peer")
+    assert sources.acquire("layer") is None
+    assert sources.acquire("layer") == "peer"
+
+
+def test_discarded_source_is_not_handed_out():
+    sources = SourcePool(fanout=1)
+    sources.release("layer", None, "dead")
+    sources.release("layer", None, "alive")
+    assert sources.acquire("layer") is None
+    sources.discard("dead")
+    assert sources.acquire("layer") == "alive"
+    waiter = gevent.spawn(sources.acquire, "layer")
+    gevent.sleep(0)
+    assert not waiter.ready()
+    sources.release("layer", "alive")
+    assert waiter.get(timeout=1) == "alive"
+
+
+def test_retain_drops_sources_of_every_key():
+    sources = SourcePool(fanout=2)
+    for key in ("image", "layer"):
+        sources.release(key, None, "a")
+        sources.release(key, None, "b")
+    sources.retain(lambda source: source != "a")
+    assert sources.sources == {"image": ["b"], "layer": ["b"]}
@@ -0,0 +1,202 @@
+import os
+import random
+import stat
+
+import pytest
+
+from mrkt.common import sync
+from mrkt.common.consts import SYNC_CHUNK_MIN_SIZE, SYNC_CHUNK_MAX_SIZE, SYNC_IGNORE_FILENAME
+
+
+def random_bytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def write(root, rel, data=b"", mode=None):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+def push(src, store, sync_id):
+    local = sync.scan(str(src))
+    changed, deleted, missing = sync.diff(local, store.manifest(""))
+    store.put_chunks(sync_id, sync.read_chunks(str(src), local, list(missing)))
+    store.apply(sync_id, "", changed, deleted)
+    return changed, deleted, missing
+
+
+def assert_synced(src, dst, store):
+    local = sync.scan(str(src))
+    assert sync.scan(str(dst)) == store.manifests[""]
+    assert {rel: (entry["mode"], entry["chunks"]) for rel, entry in store.manifests[""].items()} == \
+           {rel: (entry["mode"], entry["chunks"]) for rel, entry in local.items()}
+    for rel, entry in local.items():
+        if entry["chunks"] is not None:
+            with open(os.path.join(src, rel), "rb") as a, open(os.path.join(dst, rel), "rb") as b:
+                assert a.read() == b.read()
+
+
+@pytest.fixture
+def trees(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    return src, dst, sync.ManifestStore(str(dst))
+
+
+@pytest.mark.parametrize("read_size", [1000, 4096, SYNC_CHUNK_MAX_SIZE + 1, 1 << 20])
+def test_cut_points_do_not_depend_on_read_size(tmp_path, read_size):
+    path = tmp_path / "data"
+    path.write_bytes(random_bytes(3 << 20))
+    assert sync.file_chunks(str(path), read_size) == sync.file_chunks(str(path))
+
+
+def test_cut_points_match_scalar_gear_hash():
+    data = random_bytes(1 << 20, seed=1) + bytes(200000) + random_bytes(100000, seed=2)
+    points = list(sync.cut_points(data))
+    assert points == list(sync.cut_points(data, vectorised=False))
+    sizes = [end - start for start, end in zip([0] + points, points)]
+    assert points[-1] == len(data)
+    assert all(SYNC_CHUNK_MIN_SIZE < size <= SYNC_CHUNK_MAX_SIZE for size in sizes[:-1])
+
+
+def test_cut_points_resynchronise_after_an_insert():
+    data = random_bytes(1 << 20)
+    before = set(sync.cut_points(data))
+    after = {end - 10 for end in sync.cut_points(random_bytes(10, seed=3) + data)}
+    assert len(before - after) <= 2
+
+
+def test_sync_adds_and_modifies_files(trees):
+    src, dst, store = trees
+    write(src, "a.py", b"print(1)\n")
+    write(src, "pkg/data.bin", random_bytes(300000))
+    push(src, store, 1)
+    assert_synced(src, dst, store)
+    data = bytearray(random_bytes(300000))
+    data[150000:150010] = b"0123456789"
+    write(src, "pkg/data.bin", bytes(data))
+    write(src, "pkg/new.txt", b"new")
+    changed, deleted, missing = push(src, store, 2)
+    assert set(changed) == {"pkg/data.bin", "pkg/new.txt"} and not deleted
+    assert sum(missing.values()) < 100000
+    assert_synced(src, dst, store)
+
+
+def test_sync_deletes_files_and_directories(trees):
+    src, dst, store = trees
+    write(src, "keep.txt", b"keep")
+    write(src, "gone.txt", b"gone")
+    write(src, "old/nested/file.txt", b"nested")
+    push(src, store, 1)
+    os.remove(src / "gone.txt")
+    os.remove(src / "old/nested/file.txt")
+    os.rmdir(src / "old/nested")
+    os.rmdir(src / "old")
+    _, deleted, _ = push(src, store, 2)
+    assert deleted == ["old/nested/file.txt", "old/nested", "old", "gone.txt"]
+    assert not os.path.exists(dst / "old") and not os.path.exists(dst / "gone.txt")
+    assert_synced(src, dst, store)
+
+
+def test_sync_replaces_directories_and_files(trees):
+    src, dst, store = trees
+    write(src, "was_dir/inner.txt", b"inner")
+    write(src, "was_file", b"file")
+    push(src, store, 1)
+    os.remove(src / "was_dir/inner.txt")
+    os.rmdir(src / "was_dir")
+    write(src, "was_dir", b"now a file")
+    os.remove(src / "was_file")
+    write(src, "was_file/inner.txt", b"now a dir")
+    push(src, store, 2)
+    assert os.path.isfile(dst / "was_dir") and os.path.isdir(dst / "was_file")
+    assert_synced(src, dst, store)
+
+
+def test_sync_applies_mode_changes(trees):
+    src, dst, store = trees
+    write(src, "run.sh", b"#!/bin/sh\n", 0o644)
+    push(src, store, 1)
+    os.chmod(src / "run.sh", 0o755)
+    changed, _, missing = push(src, store, 2)
+    assert set(changed) == {"run.sh"} and not missing
+    assert stat.S_IMODE(os.stat(dst / "run.sh").st_mode) == 0o755
+    assert_synced(src, dst, store)
+
+
+def test_apply_keeps_manifest_without_rescanning(trees, monkeypatch):
+    src, dst, store = trees
+    write(src, "a.bin", random_bytes(100000))
+    push(src, store, 1)
+    write(src, "b.bin", random_bytes(100000, seed=1))
+    local = sync.scan(str(src))
+    changed, deleted, missing = sync.diff(local, store.manifest(""))
+    store.put_chunks(2, sync.read_chunks(str(src), local, list(missing)))
+    monkeypatch.setattr(sync, "file_chunks", None)
+    store.apply(2, "", changed, deleted)
+    monkeypatch.undo()
+    assert_synced(src, dst, store)
+
+
+def test_ignore_rules_match_like_gitignore():
+    rules = sync.IgnoreRules(["# comment", "", "*.log", "!keep.log", "build/", "/docs/*.tmp", "data/raw"])
+    assert rules.match("a.log") and rules.match("sub/a.log")
+    assert not rules.match("keep.log") and not rules.match("sub/keep.log")
+    assert rules.match("build", is_dir=True) and rules.match("sub/build", is_dir=True)
+    assert not rules.match("build")
+    assert rules.match("docs/a.tmp") and not rules.match("sub/docs/a.tmp")
+    assert rules.match("data/raw") and not rules.match("raw")
+    assert not rules.match("# comment")
+
+
+def test_ignore_rules_are_loaded_with_defaults(tmp_path):
+    write(tmp_path, SYNC_IGNORE_FILENAME, b"*.csv\n")
+    write(tmp_path, "main.py")
+    write(tmp_path, "data.csv")
+    write(tmp_path, "__pycache__/main.cpython.pyc")
+    write(tmp_path, ".git/HEAD")
+    rules = sync.IgnoreRules.load(str(tmp_path))
+    assert sorted(rel for rel, _ in sync.walk(str(tmp_path), rules)) == [SYNC_IGNORE_FILENAME, "main.py"]
+
+
+def test_sync_keeps_symlinks_as_links(trees):
+    src, dst, store = trees
+    write(src, "real/data.txt", b"data")
+    os.symlink("real/data.txt", src / "file_link")
+    os.symlink("real", src / "dir_link")
+    os.symlink("missing", src / "dangling")
+    push(src, store, 1)
+    assert os.readlink(dst / "file_link") == "real/data.txt"
+    assert os.readlink(dst / "dir_link") == "real" and os.readlink(dst / "dangling") == "missing"
+    assert sync.scan(str(src))["dir_link"]["link"] == "real"
+    assert_synced(src, dst, store)
+    os.remove(src / "file_link")
+    write(src, "file_link", b"now a file")
+    os.remove(src / "dir_link")
+    os.symlink("real/data.txt", src / "dir_link")
+    os.remove(src / "dangling")
+    changed, deleted, _ = push(src, store, 2)
+    assert set(changed) == {"file_link", "dir_link"} and deleted == ["dangling"]
+    assert os.path.isfile(dst / "file_link") and not os.path.islink(dst / "file_link")
+    assert os.readlink(dst / "dir_link") == "real/data.txt" and os.path.isdir(dst / "real")
+    assert_synced(src, dst, store)
+
+
+def test_agent_answers_an_up_to_date_manifest_with_none(trees, monkeypatch):
+    import sys
+    from mrkt.agent.agent import DynamicAgent
+    src, dst, store = trees
+    write(src, "a.py", b"A = 1\n")
+    push(src, store, 1)
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    agent = DynamicAgent(str(dst))
+    fingerprint = sync.fingerprint(sync.scan(str(src)))
+    assert agent._adm_dir_manifest("", (), fingerprint) is None
+    write(src, "b.py", b"B = 1\n")
+    assert set(agent._adm_dir_manifest("", (), sync.fingerprint(sync.scan(str(src))))) == {"a.py"}
+    assert set(agent._adm_dir_manifest("")) == {"a.py"}